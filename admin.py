@@ -3,12 +3,17 @@
 # Admin bot (PTB v20) — separate token from main bot
 #
 # Features:
-# 1) Manage Subscriptions  (Add Premium / Remove Premium)
-# 2) Stats                 (Back button included)
-# 3) Broadcast             (to ALL users or to EXPIRED users only)
+# 1) Manage Subscriptions  (Add Premium / Remove Premium, atomic updates)
+# 2) Stats                 (materialized document, reconciled periodically)
+# 3) Broadcast             (audiences: all / active / expired / never premium /
+#                           inactive N days / banned)
 #    - Sends via the MAIN BOT (BOT_TOKEN), not the admin bot
 #    - Supports text (HTML) & media (photo/video/animation/document)
-#      by downloading with admin bot and reuploading via main bot
+#      by file_id; downloaded and uploaded once only if the main bot
+#      cannot use the admin bot's file_id
+#    - Rate-limited concurrent sends; runs as a job in admin_broadcasts
+#      that can be cancelled, resumed, and survives restarts
+# 4) Users                 (paginated browser, lookup by user ID)
 #
 # .env:
 #   ADMIN_BOT_TOKEN=...
@@ -23,9 +28,10 @@ import time
 import json
 import asyncio
 import secrets
+import itertools
 import traceback
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional
 
 # tolerant .env loader
 def safe_load_env():
@@ -57,10 +63,19 @@ from telegram.ext import (
     ContextTypes,
     filters,
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, RetryAfter, NetworkError, TimedOut
 
 ADMIN_BOT_TOKEN = os.getenv("ADMIN_BOT_TOKEN")
 MAIN_BOT_TOKEN  = os.getenv("BOT_TOKEN")            # main bot token (to broadcast)
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", "600"))  # seconds
+BROADCAST_RATE = float(os.getenv("ADMIN_BROADCAST_RATE", "28"))               # msgs/sec, Bot API allows ~30
+BROADCAST_CONCURRENCY = int(os.getenv("ADMIN_BROADCAST_CONCURRENCY", "20"))   # in-flight sends
+BROADCAST_RETRIES = int(os.getenv("ADMIN_BROADCAST_RETRIES", "3"))            # per recipient, network errors / RetryAfter
+BROADCAST_BACKOFF = float(os.getenv("ADMIN_BROADCAST_BACKOFF", "2"))          # seconds, doubled per network retry
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("ADMIN_BROADCAST_PROGRESS", "5"))  # seconds between status edits
+BROADCAST_WINDOW = int(os.getenv("ADMIN_BROADCAST_WINDOW", "1000"))            # audience ids read ahead of the senders
+INACTIVE_DAYS = int(os.getenv("ADMIN_INACTIVE_DAYS", "30"))                   # "inactive" broadcast audience
+USERS_PAGE_SIZE = int(os.getenv("ADMIN_USERS_PAGE", "10"))                    # user browser rows per page
 
 ADMIN_IDS = set()
 for piece in (os.getenv("ADMIN_IDS", "")).replace(" ", "").split(","):
@@ -78,50 +93,76 @@ if not MONGO_URI:
     sys.exit("❌ .env must have MONGO_URI for MongoDB")
 
 # Initialize MongoDB
-from pymongo import MongoClient
+from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument
 try:
     mongo_client = MongoClient(MONGO_URI)
     db = mongo_client[DB_NAME]
     users_collection = db["users"]
+    sessions_collection = db["sessions"]
     admin_broadcasts = db["admin_broadcasts"]
+    stats_collection = db["stats"]  # materialized stats: {"_id": "global", ...}
     print("✅ MongoDB connected for admin bot")
 except Exception as e:
     sys.exit(f"❌ MongoDB connection failed: {e}")
 
+try:
+    users_collection.create_index("user_id", unique=True)  # audiences are streamed in user_id order
+    users_collection.create_index("premium.until_ts")  # premium broadcast audiences
+    users_collection.create_index("updated_at")  # inactive-for-N-days audience
+    users_collection.create_index("premium.active", partialFilterExpression={"premium.active": True})   # "active" $or branch
+    users_collection.create_index("premium.banned", partialFilterExpression={"premium.banned": True})   # "banned" audience
+    admin_broadcasts.create_index([("status", 1), ("created_at", -1)])
+except Exception as e:
+    print(f"⚠️ Index warning: {e}")
+
 # ---------- MongoDB user storage ----------
-def list_user_ids() -> List[int]:
-    """Get all user IDs from MongoDB"""
+# Only what the user browser shows; never the group lists or ad setup
+USER_SUMMARY_FIELDS = {
+    "_id": 0, "user_id": 1, "updated_at": 1, "ads_running": 1, "bot_blocked": 1,
+    "premium.until_ts": 1, "premium.active": 1, "premium.banned": 1,
+    "premium.purchases_total": 1, "premium.purchases_count": 1, "metrics.sent_total": 1,
+}
+
+def with_sessions(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    ids = [d["user_id"] for d in docs]
     try:
-        user_docs = users_collection.find({}, {"user_id": 1})
-        return sorted([doc["user_id"] for doc in user_docs if "user_id" in doc])
+        have = {d["user_id"] for d in sessions_collection.find({"user_id": {"$in": ids}}, {"_id": 0, "user_id": 1})}
     except Exception as e:
-        print(f"⚠️ Error fetching user IDs: {e}")
-        return []
+        print(f"⚠️ Error loading sessions: {e}")
+        have = set()
+    for d in docs:
+        d["session"] = d["user_id"] in have
+    return docs
 
-def load_user(uid: int) -> Dict[str, Any]:
-    """Load user data from MongoDB"""
+def users_page(after: int = 0, before: int = 0, limit: int = USERS_PAGE_SIZE) -> Dict[str, Any]:
+    """One page of user summaries in user_id order, keyset-paginated on the user_id index.
+    Pass `after` (last id of the current page) for the next page, `before` (first id) for the previous."""
     try:
-        user_doc = users_collection.find_one({"user_id": uid})
-        if user_doc:
-            user_doc.pop("_id", None)
-            return user_doc
-        return {}
+        if before:
+            docs = list(users_collection.find({"user_id": {"$lt": before}}, USER_SUMMARY_FIELDS)
+                        .sort("user_id", -1).limit(limit + 1))
+            more_before = len(docs) > limit
+            docs = docs[:limit][::-1]
+            more_after = True
+        else:
+            docs = list(users_collection.find({"user_id": {"$gt": after}}, USER_SUMMARY_FIELDS)
+                        .sort("user_id", 1).limit(limit + 1))
+            more_after = len(docs) > limit
+            docs = docs[:limit]
+            more_before = bool(after)
     except Exception as e:
-        print(f"⚠️ Error loading user {uid}: {e}")
-        return {}
+        print(f"⚠️ Error listing users: {e}")
+        docs, more_before, more_after = [], False, False
+    return {"users": with_sessions(docs), "prev": more_before, "next": more_after}
 
-def save_user(uid: int, data: Dict[str, Any]):
-    """Save user data to MongoDB"""
+def user_summary(uid: int) -> Optional[Dict[str, Any]]:
     try:
-        data["user_id"] = uid
-        data["updated_at"] = time.time()
-        users_collection.update_one(
-            {"user_id": uid},
-            {"$set": data},
-            upsert=True
-        )
+        doc = users_collection.find_one({"user_id": uid}, USER_SUMMARY_FIELDS)
     except Exception as e:
-        print(f"⚠️ Error saving user {uid}: {e}")
+        print(f"⚠️ Error loading user {uid}: {e}")
+        return None
+    return with_sessions([doc])[0] if doc else None
 
 def now_ts() -> int:
     return int(time.time())
@@ -158,6 +199,175 @@ def had_premium_before(prem: Dict[str, Any]) -> bool:
         or _truthy(prem.get("active", False))
     )
 
+# ---------- Materialized stats ----------
+# Events $inc the single stats document as they happen; reconcile_stats()
+# periodically rewrites it from compute_stats() to correct drift (and
+# subscriptions that simply ran out, which raise no event).
+STATS_DOC_ID = "global"
+STATS_FIELDS = ("total", "banned", "active", "expired", "purchases", "sent")
+
+def bump_stats(inc: Dict[str, float]):
+    inc = {k: v for k, v in inc.items() if v}
+    if not inc:
+        return
+    try:
+        stats_collection.update_one({"_id": STATS_DOC_ID}, {"$inc": inc}, upsert=True)
+    except Exception as e:
+        print(f"⚠️ Stats update error: {e}")
+
+def premium_state(prem: Dict[str, Any]) -> Optional[str]:
+    if is_premium_active(prem):
+        return "active"
+    if had_premium_before(prem):
+        return "expired"
+    return None
+
+def premium_stats_delta(before: Dict[str, Any], after: Dict[str, Any], amount: float = 0.0) -> Dict[str, float]:
+    """Counter changes for one user's premium edit (grant, revoke, ban, purchase)"""
+    inc: Dict[str, float] = {"purchases": amount}
+    old, new = premium_state(before), premium_state(after)
+    if old != new:
+        if old:
+            inc[old] = inc.get(old, 0) - 1
+        if new:
+            inc[new] = inc.get(new, 0) + 1
+    inc["banned"] = int(bool(after.get("banned", False))) - int(bool(before.get("banned", False)))
+    return inc
+
+def reconcile_stats() -> Dict[str, Any]:
+    st = compute_stats()
+    try:
+        stats_collection.update_one(
+            {"_id": STATS_DOC_ID},
+            {"$set": {**{k: st[k] for k in STATS_FIELDS}, "reconciled_at": now_ts()}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"⚠️ Stats reconcile error: {e}")
+    return st
+
+def read_stats() -> Dict[str, Any]:
+    """The stats document (built on first use)"""
+    try:
+        doc = stats_collection.find_one({"_id": STATS_DOC_ID})
+    except Exception as e:
+        print(f"⚠️ Stats read error: {e}")
+        doc = None
+    if not doc or "reconciled_at" not in doc:
+        return reconcile_stats()
+    return {k: doc.get(k, 0) for k in STATS_FIELDS}
+
+async def reconcile_stats_loop():
+    while True:
+        try:
+            await asyncio.to_thread(reconcile_stats)
+        except Exception as e:
+            print(f"⚠️ Stats reconcile error: {e}")
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+
+async def on_startup(app: Application):
+    app.create_task(reconcile_stats_loop())
+    app.create_task(resume_broadcast_jobs(app))
+
+# ---------- Premium updates ----------
+# Single atomic updates on the premium.* paths only: no read-modify-write of the
+# whole user document, so nothing main.py writes meanwhile is overwritten.
+def grant_premium(uid: int, days: int, amount: float = 0.0) -> Optional[Dict[str, Any]]:
+    """Extend premium by `days` from max(now, until_ts); returns the new premium or None on error"""
+    now = now_ts()
+    try:
+        doc = users_collection.find_one_and_update(
+            {"user_id": uid},
+            [{"$set": {
+                "premium.until_ts": {"$toLong": {"$add": [{"$max": [now, {"$trunc": _num("$premium.until_ts")}]}, days * 86400]}},
+                "premium.active": True,  # keep a boolean flag too (main bot reads it)
+                "premium.purchases_total": {"$add": [_num("$premium.purchases_total"), amount]},
+                "premium.purchases_count": {"$toInt": {"$add": [{"$trunc": _num("$premium.purchases_count")}, 1 if amount > 0 else 0]}},
+                "premium.banned": {"$ifNull": ["$premium.banned", False]},
+                "updated_at": time.time(),
+            }}],
+            projection={"_id": 0, "premium": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+    except Exception as e:
+        print(f"⚠️ Error granting premium to {uid}: {e}")
+        return None
+    if doc is None:
+        bump_stats({"total": 1})
+    before = (doc or {}).get("premium") or {}
+    after = {
+        **before,
+        "until_ts": max(now, _to_int(before.get("until_ts", 0))) + days * 86400,
+        "active": True,
+        "purchases_total": float(before.get("purchases_total", 0.0) or 0.0) + amount,
+        "purchases_count": _to_int(before.get("purchases_count", 0)) + (1 if amount > 0 else 0),
+        "banned": before.get("banned", False),
+    }
+    bump_stats(premium_stats_delta(before, after, amount))
+    return after
+
+def revoke_premium(uid: int) -> bool:
+    """End premium now; False if the user does not exist"""
+    try:
+        doc = users_collection.find_one_and_update(
+            {"user_id": uid},
+            {"$set": {"premium.until_ts": 0, "premium.active": False, "updated_at": time.time()}},
+            projection={"_id": 0, "premium": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+    except Exception as e:
+        print(f"⚠️ Error revoking premium for {uid}: {e}")
+        return False
+    if doc is None:
+        return False
+    before = doc.get("premium") or {}
+    bump_stats(premium_stats_delta(before, {**before, "until_ts": 0, "active": False}))
+    return True
+
+# ---------- Stats aggregation ----------
+def _num(path: str) -> Dict[str, Any]:
+    """Lenient number, like _to_int / float(... or 0): bad or missing values count as 0"""
+    return {"$convert": {"input": path, "to": "double", "onError": 0, "onNull": 0}}
+
+def stats_pipeline(now: int) -> List[Dict[str, Any]]:
+    """One pass over users: same rules as is_premium_active / had_premium_before"""
+    active_flag = {"$in": [
+        {"$toLower": {"$convert": {"input": "$premium.active", "to": "string", "onError": "", "onNull": ""}}},
+        ["1", "true", "yes", "y", "on"],
+    ]}
+    until_ts = {"$trunc": _num("$premium.until_ts")}
+    return [
+        {"$project": {
+            "_id": 0,
+            "banned": {"$not": [{"$in": [{"$ifNull": ["$premium.banned", None]}, [False, None, 0, ""]]}]},
+            "active": {"$or": [active_flag, {"$gt": [until_ts, now]}]},
+            "had": {"$or": [active_flag, {"$gt": [until_ts, 0]}, {"$gt": [{"$trunc": _num("$premium.purchases_count")}, 0]}]},
+            "purchases": _num("$premium.purchases_total"),
+            "sent": {"$trunc": _num("$metrics.sent_total")},
+        }},
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "banned": {"$sum": {"$cond": ["$banned", 1, 0]}},
+            "active": {"$sum": {"$cond": ["$active", 1, 0]}},
+            "expired": {"$sum": {"$cond": [{"$and": [{"$not": ["$active"]}, "$had"]}, 1, 0]}},
+            "purchases": {"$sum": "$purchases"},
+            "sent": {"$sum": "$sent"},
+        }},
+    ]
+
+def compute_stats(collection=None) -> Dict[str, Any]:
+    """Admin stats in a single aggregation (no per-user loads)"""
+    collection = users_collection if collection is None else collection
+    empty = {"total": 0, "banned": 0, "active": 0, "expired": 0, "purchases": 0.0, "sent": 0}
+    try:
+        rows = list(collection.aggregate(stats_pipeline(now_ts())))
+    except Exception as e:
+        print(f"⚠️ Stats aggregation error: {e}")
+        return empty
+    return {**empty, **rows[0]} if rows else empty
+
 # ---------- Admin UI ----------
 ADMIN_STATE: Dict[int, Dict[str, Any]] = {}  # per-admin-chat state
 
@@ -166,6 +376,7 @@ def admin_menu_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("1️⃣ Manage Subscriptions", callback_data="adm:subs")],
         [InlineKeyboardButton("2️⃣ Stats", callback_data="adm:stats")],
         [InlineKeyboardButton("3️⃣ Broadcast", callback_data="adm:bc")],
+        [InlineKeyboardButton("4️⃣ Users", callback_data="usr:p:0")],
     ])
 
 def subs_menu_kb() -> InlineKeyboardMarkup:
@@ -175,10 +386,67 @@ def subs_menu_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("🔙 Back", callback_data="adm:back")]
     ])
 
+def _fmt_date(ts) -> str:
+    ts = _to_int(ts, 0)
+    return time.strftime("%Y-%m-%d", time.localtime(ts)) if ts else "—"
+
+def user_line(u: Dict[str, Any]) -> str:
+    prem = u.get("premium") or {}
+    flags = "".join([
+        "💎" if is_premium_active(prem) else "",
+        "🟢" if u.get("ads_running") else "",
+        "🔑" if u.get("session") else "",
+        "⛔" if prem.get("banned") else "",
+        "🚫" if u.get("bot_blocked") else "",
+    ])
+    sent = _to_int((u.get("metrics") or {}).get("sent_total", 0))
+    return f"<code>{u['user_id']}</code> {flags}\n   until {_fmt_date(prem.get('until_ts'))} · sent {sent}"
+
+def user_detail_text(u: Dict[str, Any]) -> str:
+    prem = u.get("premium") or {}
+    state = premium_state(prem)
+    return (
+        f"👤 User <code>{u['user_id']}</code>\n\n"
+        f"💎 Premium: {state or 'never'} (until {_fmt_date(prem.get('until_ts'))})\n"
+        f"💳 Purchases: {_to_int(prem.get('purchases_count', 0))} · {float(prem.get('purchases_total', 0) or 0):.2f}\n"
+        f"📤 Ads sent: {_to_int((u.get('metrics') or {}).get('sent_total', 0))}\n"
+        f"🚀 Campaign running: {'yes' if u.get('ads_running') else 'no'}\n"
+        f"🔑 Session: {'present' if u.get('session') else 'none'}\n"
+        f"⛔ Banned: {'yes' if prem.get('banned') else 'no'}\n"
+        f"🚫 Blocked the bot: {'yes' if u.get('bot_blocked') else 'no'}\n"
+        f"🕒 Last active: {_fmt_date(u.get('updated_at'))}"
+    )
+
+def users_page_text(page: Dict[str, Any]) -> str:
+    if not page["users"]:
+        return "👥 Users\n\nNo users here."
+    legend = "💎 premium · 🟢 ads running · 🔑 session · ⛔ banned · 🚫 blocked bot"
+    return "👥 Users\n\n" + "\n".join(user_line(u) for u in page["users"]) + f"\n\n{legend}"
+
+def users_page_kb(page: Dict[str, Any]) -> InlineKeyboardMarkup:
+    users = page["users"]
+    rows = [[InlineKeyboardButton(f"👤 {u['user_id']}", callback_data=f"usr:v:{u['user_id']}")] for u in users]
+    nav = []
+    if page["prev"] and users:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"usr:b:{users[0]['user_id']}"))
+    if page["next"] and users:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"usr:p:{users[-1]['user_id']}"))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton("🔎 Search by ID", callback_data="usr:find")])
+    rows.append([InlineKeyboardButton("🔙 Back", callback_data="adm:back")])
+    return InlineKeyboardMarkup(rows)
+
+def user_detail_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔎 Search by ID", callback_data="usr:find")],
+        [InlineKeyboardButton("👥 Users", callback_data="usr:p:0"), InlineKeyboardButton("🔙 Back", callback_data="adm:back")],
+    ])
+
 def broadcast_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📢 To ALL users", callback_data="bc:all")],
-        [InlineKeyboardButton("⏳ To EXPIRED users only", callback_data="bc:expired")],
+        *[[InlineKeyboardButton(f"To {label}", callback_data=f"bc:{key}")] for key, label in AUDIENCES.items()],
+        [InlineKeyboardButton("📋 Broadcast jobs", callback_data="bcj:list")],
         [InlineKeyboardButton("🔙 Back", callback_data="adm:back")]
     ])
 
@@ -238,6 +506,46 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return await update.callback_query.answer()
 
+    if data.startswith("usr:p:") or data.startswith("usr:b:"):
+        st.clear()
+        ADMIN_STATE[chat_id] = st
+        try:
+            pivot = int(data.split(":")[2])
+        except ValueError:
+            return await update.callback_query.answer()
+        if data.startswith("usr:p:"):
+            page = await asyncio.to_thread(users_page, pivot)
+        else:
+            page = await asyncio.to_thread(users_page, 0, pivot)
+        try:
+            await update.callback_query.message.edit_text(users_page_text(page), reply_markup=users_page_kb(page), parse_mode="HTML")
+        except Exception:
+            await update.callback_query.message.reply_text(users_page_text(page), reply_markup=users_page_kb(page), parse_mode="HTML")
+        return await update.callback_query.answer()
+
+    if data.startswith("usr:v:"):
+        try:
+            uid = int(data.split(":")[2])
+        except ValueError:
+            return await update.callback_query.answer()
+        u = await asyncio.to_thread(user_summary, uid)
+        if not u:
+            return await update.callback_query.answer("User not found.", show_alert=True)
+        try:
+            await update.callback_query.message.edit_text(user_detail_text(u), reply_markup=user_detail_kb(), parse_mode="HTML")
+        except Exception:
+            await update.callback_query.message.reply_text(user_detail_text(u), reply_markup=user_detail_kb(), parse_mode="HTML")
+        return await update.callback_query.answer()
+
+    if data == "usr:find":
+        st["mode"] = "user_lookup"
+        ADMIN_STATE[chat_id] = st
+        await update.callback_query.message.reply_text(
+            "Send: <code>USER_ID</code>\nExample: <code>5433096979</code>",
+            parse_mode="HTML"
+        )
+        return await update.callback_query.answer()
+
     if data == "adm:stats":
         st.clear()
         ADMIN_STATE[chat_id] = st
@@ -259,52 +567,64 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.callback_query.message.reply_text(text, reply_markup=broadcast_menu_kb())
         return await update.callback_query.answer()
 
-    if data == "bc:all":
-        st["mode"] = "broadcast"
-        st["audience"] = "all"
-        ADMIN_STATE[chat_id] = st
-        await update.callback_query.message.reply_text(
-            "Send the message to broadcast to ALL users.\n• HTML is supported.\n• Media supported (photo/video/animation/document)."
-        )
+    if data == "bcj:list":
+        text = await asyncio.to_thread(broadcast_jobs_text)
+        kb = await asyncio.to_thread(broadcast_jobs_kb)
+        try:
+            await update.callback_query.message.edit_text(text, reply_markup=kb)
+        except Exception:
+            await update.callback_query.message.reply_text(text, reply_markup=kb)
         return await update.callback_query.answer()
 
-    if data == "bc:expired":
+    if data.startswith("bcj:cancel:") or data.startswith("bcj:resume:"):
+        action, job_id = data.split(":")[1:]
+        try:
+            job = await asyncio.to_thread(admin_broadcasts.find_one, {"_id": ObjectId(job_id)}, {"status": 1})
+        except Exception:
+            job = None
+        if not job:
+            return await update.callback_query.answer("Unknown broadcast.", show_alert=True)
+        if action == "cancel":
+            if job["status"] != "running":
+                return await update.callback_query.answer("This broadcast is not running.")
+            await asyncio.to_thread(update_broadcast_job, job_id, {"status": "cancelled"})
+            task = BROADCAST_TASKS.get(job_id)
+            if task and not task.done():
+                task.cancel()
+            await update.callback_query.answer("Broadcast cancelled")
+        else:
+            if job["status"] != "cancelled" or job_id in BROADCAST_TASKS:
+                return await update.callback_query.answer("This broadcast cannot be resumed.")
+            await asyncio.to_thread(update_broadcast_job, job_id, {"status": "running"})
+            schedule_broadcast_job(context.bot, job_id)
+            await update.callback_query.answer("Broadcast resumed")
+        text = await asyncio.to_thread(broadcast_jobs_text)
+        kb = await asyncio.to_thread(broadcast_jobs_kb)
+        try:
+            await update.callback_query.message.edit_text(text, reply_markup=kb)
+        except Exception:
+            pass
+        return
+
+    if data.startswith("bc:") and data[3:] in AUDIENCES:
         st["mode"] = "broadcast"
-        st["audience"] = "expired"
+        st["audience"] = data[3:]
         ADMIN_STATE[chat_id] = st
         await update.callback_query.message.reply_text(
-            "Send the message to broadcast to EXPIRED users only.\n• HTML is supported.\n• Media supported (photo/video/animation/document)."
+            f"Send the message to broadcast to {AUDIENCES[data[3:]]}.\n• HTML is supported.\n• Media supported (photo/video/animation/document)."
         )
         return await update.callback_query.answer()
 
     await update.callback_query.answer()
 
 async def build_stats_text() -> str:
-    uids = list_user_ids()
-    total_members = len(uids)
-    prem_active = 0
-    banned = 0
-    total_purchases = 0.0
-    active = 0
-    expired = 0
-    sent_total = 0
-
-    for uid in uids:
-        u = load_user(uid)
-        prem = u.get("premium", {}) or {}
-        if prem.get("banned", False):
-            banned += 1
-
-        total_purchases += float(prem.get("purchases_total", 0.0) or 0.0)
-        sent_total += int(u.get("metrics", {}).get("sent_total", 0) or 0)
-
-        active_now = is_premium_active(prem)
-        if active_now:
-            prem_active += 1
-            active += 1
-        else:
-            if had_premium_before(prem):
-                expired += 1
+    st = await asyncio.to_thread(read_stats)
+    total_members = st["total"]
+    prem_active = active = st["active"]
+    banned = st["banned"]
+    total_purchases = float(st["purchases"])
+    expired = st["expired"]
+    sent_total = int(st["sent"])
 
     total_purchases_fmt = (
         str(int(total_purchases)) if float(total_purchases).is_integer() else str(round(total_purchases, 2))
@@ -320,6 +640,454 @@ async def build_stats_text() -> str:
         f"        📢 Total Message Sent: {sent_total}"
     )
 
+# ---------- Broadcast audiences ----------
+REACHABLE = {"bot_blocked": {"$ne": True}}  # users who blocked the main bot are skipped
+
+# Each audience is a MongoDB filter. Its ids are streamed along the unique user_id index
+# (no in-memory sort, and a broadcast resumes from a user_id). Counting an audience uses
+# the filter indexes: the premium ones range over premium.until_ts (the
+# {"premium.active": True} branch of "active" and the "banned" audience have partial
+# indexes of their own); "inactive" uses the updated_at index.
+# main.py and this bot both store until_ts as a number and active/banned as bools.
+def audience_filter(audience: str, now: Optional[int] = None) -> Dict[str, Any]:
+    now = now_ts() if now is None else now
+    not_active = {"premium.active": {"$ne": True}}
+    never_paid = {"premium.purchases_count": {"$in": [0, None]}}
+    if audience == "active":
+        q = {"$or": [{"premium.until_ts": {"$gt": now}}, {"premium.active": True}]}
+    elif audience == "expired":
+        q = {**not_active, "$or": [
+            {"premium.until_ts": {"$gt": 0, "$lte": now}},
+            {"premium.until_ts": {"$in": [0, None]}, "premium.purchases_count": {"$gt": 0}},
+        ]}
+    elif audience == "never":
+        q = {**not_active, **never_paid, "premium.until_ts": {"$in": [0, None]}}
+    elif audience == "inactive":
+        q = {"updated_at": {"$lt": now - INACTIVE_DAYS * 86400}}
+    elif audience == "banned":
+        q = {"premium.banned": True}
+    else:
+        q = {}
+    return {**q, **REACHABLE}
+
+AUDIENCES = {
+    "all": "📢 ALL users",
+    "active": "💎 ACTIVE premium",
+    "expired": "⏳ EXPIRED premium",
+    "never": "🆕 NEVER premium",
+    "inactive": f"💤 INACTIVE {INACTIVE_DAYS}+ days",
+    "banned": "⛔ BANNED users",
+}
+
+def audience_query(audience: str, after: int = 0) -> Dict[str, Any]:
+    q = audience_filter(audience)
+    if after:
+        q["user_id"] = {"$gt": after}
+    return q
+
+def audience_ids(audience: str, after: int = 0) -> Iterator[int]:
+    """User ids of an audience above ``after``, ascending, streamed from a projected cursor
+    on the user_id index. Blocking: advance it from a worker thread."""
+    cur = (users_collection.find(audience_query(audience, after), {"_id": 0, "user_id": 1})
+           .sort("user_id", 1).hint([("user_id", 1)]).batch_size(BROADCAST_WINDOW))
+    for doc in cur:
+        if "user_id" in doc:
+            yield doc["user_id"]
+
+def audience_count(audience: str, after: int = 0) -> int:
+    try:
+        return users_collection.count_documents(audience_query(audience, after))
+    except Exception as e:
+        print(f"⚠️ Error counting audience {audience}: {e}")
+        return 0
+
+# ---------- Broadcast media ----------
+def broadcast_media_of(message) -> Optional[Dict[str, Any]]:
+    """Media of the admin's message; resolved to a main-bot file_id on first send"""
+    if message.photo:
+        return {"kind": "photo", "file_id": message.photo[-1].file_id, "name": f"bc_photo_{secrets.token_hex(4)}.jpg"}
+    if message.video:
+        return {"kind": "video", "file_id": message.video.file_id, "name": f"bc_video_{secrets.token_hex(4)}.mp4"}
+    if message.animation:
+        return {"kind": "animation", "file_id": message.animation.file_id, "name": f"bc_gif_{secrets.token_hex(4)}.mp4"}
+    if message.document:
+        return {"kind": "document", "file_id": message.document.file_id,
+                "name": message.document.file_name or f"file_{secrets.token_hex(3)}.bin"}
+    return None
+
+def _sent_file_id(msg, kind: str) -> Optional[str]:
+    if kind == "photo":
+        return msg.photo[-1].file_id if msg.photo else None
+    obj = getattr(msg, kind, None)
+    return obj.file_id if obj else None
+
+async def send_broadcast_media(admin_bot: Bot, main_bot: Bot, uid: int, media: Dict[str, Any], caption: str):
+    """Send by the main bot's file_id once known. Until then: try the admin bot's file_id,
+    else download it once and upload it once; the uploaded copy's file_id is reused."""
+    send = getattr(main_bot, f"send_{media['kind']}")
+    if media.get("main_file_id"):
+        return await send(uid, media["main_file_id"], caption=caption, parse_mode="HTML")
+
+    lock = media.setdefault("lock", asyncio.Lock())
+    async with lock:
+        if media.get("main_file_id"):
+            return await send(uid, media["main_file_id"], caption=caption, parse_mode="HTML")
+        if not media.get("foreign_id"):
+            try:
+                msg = await send(uid, media["file_id"], caption=caption, parse_mode="HTML")
+                media["main_file_id"] = media["file_id"]
+                return msg
+            except BadRequest as e:
+                if "file" not in str(e).lower():
+                    raise
+                media["foreign_id"] = True  # file_ids are per bot: upload instead
+        if not media.get("path"):
+            file = await admin_bot.get_file(media["file_id"])
+            temp_dir = Path("./temp")
+            temp_dir.mkdir(exist_ok=True)
+            path = temp_dir / media["name"]
+            await file.download_to_drive(str(path))
+            media["path"] = str(path)
+        with open(media["path"], "rb") as f:
+            kwargs = {"filename": media["name"]} if media["kind"] == "document" else {}
+            msg = await send(uid, f, caption=caption, parse_mode="HTML", **kwargs)
+        media["main_file_id"] = _sent_file_id(msg, media["kind"])
+        return msg
+
+# ---------- Broadcast engine ----------
+class TokenBucket:
+    """Global send rate shared by all broadcast workers; a RetryAfter pauses everyone"""
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = max(0.1, rate)
+        self.capacity = burst or self.rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def take(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    await asyncio.sleep(self.resume_at - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        self.updated = max(self.updated, self.resume_at)
+        self.tokens = 0
+
+def _retry_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return float(ra.total_seconds() if hasattr(ra, "total_seconds") else ra)
+
+def mark_bot_blocked(uids: List[int]):
+    if not uids:
+        return
+    try:
+        users_collection.update_many({"user_id": {"$in": uids}}, {"$set": {"bot_blocked": True, "bot_blocked_at": now_ts()}})
+    except Exception as e:
+        print(f"⚠️ Error marking blocked users: {e}")
+
+BROADCAST_COUNTS = ("sent", "blocked", "bad_request", "network", "failed", "retry_after")
+
+async def run_broadcast(admin_bot: Bot, main_bot: Bot, targets: Iterator[int], text: str, caption: str,
+                        media: Optional[Dict[str, Any]], counts: Optional[Dict[str, int]] = None,
+                        on_done=None, on_progress=None) -> Dict[str, int]:
+    """Send to every target through a bounded pool of workers behind one token bucket.
+    ``targets`` is read in a worker thread, at most BROADCAST_WINDOW ids ahead of the
+    finished ones. RetryAfter pauses the bucket and requeues the recipient ahead of the
+    rest, so targets finish roughly in order; network errors are retried with backoff, but
+    never a timeout (that message may have arrived). on_done(index, uid) fires once per
+    target. Users who blocked the bot are marked on every progress tick. Returns the counters."""
+    counts = counts if counts is not None else dict.fromkeys(BROADCAST_COUNTS, 0)
+    bucket = TokenBucket(BROADCAST_RATE)
+    queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+    window = asyncio.Semaphore(BROADCAST_WINDOW)  # targets read past the first unfinished one
+    finished: set = set()
+    low = 0
+    blocked: List[int] = []
+
+    def finish(i: int):
+        nonlocal low
+        finished.add(i)
+        while low in finished:
+            finished.discard(low)
+            low += 1
+            window.release()
+
+    async def producer():
+        i = 0
+        while True:
+            batch = await asyncio.to_thread(lambda: list(itertools.islice(targets, BROADCAST_WINDOW)))
+            if not batch:
+                return
+            for uid in batch:
+                await window.acquire()
+                queue.put_nowait((i, uid, 0))
+                i += 1
+
+    async def send(uid: int):
+        if media:
+            await send_broadcast_media(admin_bot, main_bot, uid, media, caption)
+        else:
+            await main_bot.send_message(uid, text, parse_mode="HTML", disable_web_page_preview=True)
+
+    async def worker():
+        while True:
+            i, uid, attempt = await queue.get()
+            retry_in = None  # seconds until the recipient is retried; None = finished
+            try:
+                await bucket.take()
+                await send(uid)
+                counts["sent"] += 1
+            except RetryAfter as e:
+                counts["retry_after"] += 1
+                bucket.pause(_retry_seconds(e) + 1)
+                if attempt < BROADCAST_RETRIES:
+                    retry_in = 0
+                else:
+                    counts["failed"] += 1
+            except Forbidden:
+                counts["blocked"] += 1
+                blocked.append(uid)
+            except BadRequest:
+                counts["bad_request"] += 1
+            except TimedOut:
+                counts["network"] += 1
+            except NetworkError:
+                if attempt < BROADCAST_RETRIES:
+                    retry_in = BROADCAST_BACKOFF * 2 ** attempt
+                else:
+                    counts["network"] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"⚠️ Broadcast to {uid} failed: {e}")
+            try:
+                if retry_in is not None:
+                    await asyncio.sleep(retry_in)
+                    queue.put_nowait((i, uid, attempt + 1))
+                else:
+                    finish(i)
+                    if on_done:
+                        on_done(i, uid)
+            finally:
+                queue.task_done()
+
+    async def flush_blocked():
+        batch = blocked[:]
+        del blocked[:]
+        await asyncio.to_thread(mark_bot_blocked, batch)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            try:
+                await flush_blocked()
+                if on_progress:
+                    await on_progress(counts)
+            except Exception as e:
+                print(f"⚠️ Broadcast progress error: {e}")
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, BROADCAST_CONCURRENCY))]
+    progress = asyncio.create_task(reporter())
+    try:
+        await producer()
+        await queue.join()
+    finally:
+        for t in workers + [progress]:
+            t.cancel()
+        await asyncio.gather(*workers, progress, return_exceptions=True)
+        mark_bot_blocked(blocked)
+    return counts
+
+def broadcast_report(counts: Dict[str, int], total: int, skipped: int, elapsed: float, rate: float) -> str:
+    return (
+        f"✅ Broadcast done in {int(elapsed)}s ({rate:.1f} msg/s)\n\n"
+        f"📤 Sent: {counts['sent']}/{total}\n"
+        f"🚫 Blocked: {counts['blocked']} (skipped next time)\n"
+        f"⚠️ Bad request: {counts['bad_request']}\n"
+        f"🌐 Network: {counts['network']}\n"
+        f"❌ Failed: {counts['failed']}\n"
+        f"⏳ Rate limited: {counts['retry_after']}\n"
+        f"⏭️ Skipped (blocked earlier): {skipped}"
+    )
+
+# ---------- Broadcast jobs ----------
+# A job in admin_broadcasts holds the payload (text/caption and media file_id), the
+# audience, and its position: every target with user_id <= cursor is finished, plus
+# the finished ids above it in "ahead". A restart resumes from there.
+BROADCAST_TASKS: Dict[str, asyncio.Task] = {}
+
+def media_ref(media: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not media:
+        return None
+    return {k: media[k] for k in ("kind", "file_id", "name", "main_file_id") if media.get(k)}
+
+def create_broadcast_job(chat_id: int, audience: str, text: str, caption: str, media: Optional[Dict[str, Any]]) -> str:
+    now = now_ts()
+    res = admin_broadcasts.insert_one({
+        "status": "running", "chat_id": chat_id, "audience": audience,
+        "text": text, "caption": caption, "media": media_ref(media),
+        "cursor": 0, "ahead": [], "total": None,
+        "counts": dict.fromkeys(BROADCAST_COUNTS, 0),
+        "created_at": now, "updated_at": now,
+    })
+    return str(res.inserted_id)
+
+def update_broadcast_job(job_id: str, fields: Dict[str, Any]):
+    try:
+        admin_broadcasts.update_one({"_id": ObjectId(job_id)}, {"$set": {**fields, "updated_at": now_ts()}})
+    except Exception as e:
+        print(f"⚠️ Broadcast job update error: {e}")
+
+def broadcast_running_kb(job_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("⏹ Cancel broadcast", callback_data=f"bcj:cancel:{job_id}")],
+        [InlineKeyboardButton("📋 Broadcast jobs", callback_data="bcj:list")],
+    ])
+
+def schedule_broadcast_job(bot: Bot, job_id: str) -> asyncio.Task:
+    task = asyncio.create_task(run_broadcast_job(bot, job_id))
+    BROADCAST_TASKS[job_id] = task
+    task.add_done_callback(lambda t: BROADCAST_TASKS.pop(job_id, None) if BROADCAST_TASKS.get(job_id) is t else None)
+    return task
+
+async def run_broadcast_job(bot: Bot, job_id: str):
+    job = await asyncio.to_thread(admin_broadcasts.find_one, {"_id": ObjectId(job_id)})
+    if not job or job.get("status") != "running":
+        return
+    cursor = int(job.get("cursor") or 0)
+    ahead = set(job.get("ahead") or [])
+    resumed_ahead = frozenset(ahead)
+    targets = (uid for uid in audience_ids(job["audience"], cursor) if uid not in resumed_ahead)
+    counts = {**dict.fromkeys(BROADCAST_COUNTS, 0), **(job.get("counts") or {})}
+    finished = sum(v for k, v in counts.items() if k != "retry_after")
+    remaining = max(0, await asyncio.to_thread(audience_count, job["audience"], cursor) - len(ahead))
+    total = job.get("total") or finished + remaining
+    media = dict(job["media"]) if job.get("media") else None
+    try:
+        skipped = await asyncio.to_thread(users_collection.count_documents, {**audience_filter(job["audience"]), "bot_blocked": True})
+    except Exception:
+        skipped = 0
+
+    out_of_order: Dict[int, int] = {}  # index -> uid, finished before an earlier target
+    low = 0  # first target not finished yet
+
+    def on_done(i: int, uid: int):
+        nonlocal low, cursor
+        out_of_order[i] = uid
+        ahead.add(uid)
+        while low in out_of_order:
+            cursor = out_of_order.pop(low)
+            ahead.discard(cursor)
+            low += 1
+
+    async def checkpoint(**fields):
+        # snapshot on the loop, where the workers mutate cursor/ahead/counts; only the write goes to a thread
+        snap = {"cursor": cursor, "ahead": sorted(u for u in ahead if u > cursor), "counts": dict(counts),
+                "total": total, "media": media_ref(media), **fields}
+        await asyncio.to_thread(update_broadcast_job, job_id, snap)
+
+    verb = "🔄 Resuming broadcast" if finished else "⏳ Broadcasting"
+    kb = broadcast_running_kb(job_id)
+    status = await bot.send_message(job["chat_id"], f"{verb} to {remaining} users...", reply_markup=kb)
+
+    async def on_progress(c: Dict[str, int]):
+        await checkpoint()
+        progress = sum(v for k, v in c.items() if k != "retry_after")
+        await status.edit_text(f"⏳ Broadcasting... {progress}/{total} (sent {c['sent']})", reply_markup=kb)
+
+    started, sent_before = time.monotonic(), counts["sent"]
+    try:
+        await run_broadcast(bot, Bot(MAIN_BOT_TOKEN), targets, job.get("text") or "", job.get("caption") or "",
+                            media, counts, on_done, on_progress)
+    except asyncio.CancelledError:
+        # cancelled from the panel (status already set) or shutting down (stays running -> resumed)
+        await checkpoint()
+        raise
+    except Exception as e:
+        await checkpoint(status="failed", error=str(e))
+        await bot.send_message(job["chat_id"], f"❌ Broadcast failed: {e}", reply_markup=admin_menu_kb())
+        return
+    finally:
+        if media and media.get("path"):
+            try: Path(media["path"]).unlink(missing_ok=True)
+            except Exception: pass
+
+    await checkpoint(status="done")
+    elapsed = time.monotonic() - started
+    rate = (counts["sent"] - sent_before) / elapsed if elapsed > 0 else 0.0
+    try:
+        await status.delete()
+    except Exception:
+        pass
+    await bot.send_message(job["chat_id"], broadcast_report(counts, total, skipped, elapsed, rate), reply_markup=admin_menu_kb())
+
+async def resume_broadcast_jobs(app: Application):
+    """On startup: continue broadcasts interrupted by a restart"""
+    try:
+        jobs = await asyncio.to_thread(lambda: list(admin_broadcasts.find({"status": "running"}, {"_id": 1})))
+    except Exception as e:
+        print(f"⚠️ Broadcast job lookup error: {e}")
+        return
+    for job in jobs:
+        job_id = str(job["_id"])
+        if job_id not in BROADCAST_TASKS:
+            schedule_broadcast_job(app.bot, job_id)
+    if jobs:
+        print(f"✅ Resumed {len(jobs)} broadcast job(s)")
+
+async def stop_broadcast_jobs(app: Application):
+    """On stop: cancel running broadcasts so each checkpoints its exact position (they stay running -> resumed)"""
+    tasks = [t for t in BROADCAST_TASKS.values() if not t.done()]
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def broadcast_jobs_text(limit: int = 10) -> str:
+    icons = {"running": "⏳", "done": "✅", "cancelled": "⏹", "failed": "❌"}
+    try:
+        jobs = list(admin_broadcasts.find({}, {"text": 0, "caption": 0, "ahead": 0}).sort("created_at", -1).limit(limit))
+    except Exception as e:
+        return f"⚠️ Could not load broadcast jobs: {e}"
+    if not jobs:
+        return "📋 Broadcast jobs\n\nNo broadcasts yet."
+    lines = ["📋 Broadcast jobs (latest first)", ""]
+    for job in jobs:
+        c = job.get("counts") or {}
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(job.get("created_at", 0)))
+        lines.append(
+            f"{icons.get(job.get('status'), '•')} {when} · {AUDIENCES.get(job.get('audience'), job.get('audience'))}\n"
+            f"   sent {c.get('sent', 0)}/{job.get('total') or '?'} · blocked {c.get('blocked', 0)} · "
+            f"failed {c.get('failed', 0) + c.get('bad_request', 0) + c.get('network', 0)}"
+        )
+    return "\n".join(lines)
+
+def broadcast_jobs_kb(limit: int = 10) -> InlineKeyboardMarkup:
+    rows = []
+    try:
+        jobs = list(admin_broadcasts.find({"status": {"$in": ["running", "cancelled"]}}, {"status": 1, "created_at": 1})
+                    .sort("created_at", -1).limit(limit))
+    except Exception:
+        jobs = []
+    for job in jobs:
+        job_id = str(job["_id"])
+        when = time.strftime("%m-%d %H:%M", time.localtime(job.get("created_at", 0)))
+        if job["status"] == "running":
+            rows.append([InlineKeyboardButton(f"⏹ Cancel {when}", callback_data=f"bcj:cancel:{job_id}")])
+        else:
+            rows.append([InlineKeyboardButton(f"▶️ Resume {when}", callback_data=f"bcj:resume:{job_id}")])
+    rows.append([InlineKeyboardButton("🔙 Back", callback_data="adm:bc")])
+    return InlineKeyboardMarkup(rows)
+
 async def on_text_or_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Owner + private only; prevents posting in groups
     if update.effective_chat.type != "private":
@@ -341,15 +1109,10 @@ async def on_text_or_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             await update.message.reply_text("Invalid numbers. Try again.")
             return
-        u = load_user(tgt)
-        prem = u.setdefault("premium", {"active": False, "until_ts": 0, "purchases_total": 0.0, "purchases_count": 0, "banned": False})
-        now = now_ts()
-        base = max(now, int(prem.get("until_ts", 0) or 0))
-        prem["until_ts"] = base + days*86400
-        prem["active"] = True  # keep a boolean flag too (main bot reads it)
-        prem["purchases_total"] = float(prem.get("purchases_total", 0.0) or 0.0) + amount
-        prem["purchases_count"] = int(prem.get("purchases_count", 0) or 0) + (1 if amount > 0 else 0)
-        save_user(tgt, u)
+        prem = await asyncio.to_thread(grant_premium, tgt, days, amount)
+        if prem is None:
+            await update.message.reply_text("⚠️ Could not update premium. Try again.")
+            return
         await update.message.reply_text(f"✅ Premium updated.\nUser: {tgt}\nDays: {days}\nUntil: {prem['until_ts']}\nAmount added: {amount}")
         return
 
@@ -363,102 +1126,45 @@ async def on_text_or_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             await update.message.reply_text("Invalid USER_ID.")
             return
-        u = load_user(tgt)
-        prem = u.setdefault("premium", {"active": False, "until_ts": 0, "purchases_total": 0.0, "purchases_count": 0, "banned": False})
-        prem["until_ts"] = 0
-        prem["active"] = False
-        save_user(tgt, u)
+        if not await asyncio.to_thread(revoke_premium, tgt):
+            await update.message.reply_text(f"⚠️ User {tgt} not found.")
+            return
         await update.message.reply_text(f"🧹 Premium removed for {tgt}.")
         return
 
+    if st.get("mode") == "user_lookup":
+        try:
+            tgt = int((update.message.text or "").strip().split()[0])
+        except Exception:
+            await update.message.reply_text("Invalid USER_ID.")
+            return
+        u = await asyncio.to_thread(user_summary, tgt)
+        if not u:
+            await update.message.reply_text(f"⚠️ User {tgt} not found.", reply_markup=user_detail_kb())
+            return
+        ADMIN_STATE[chat_id] = {}
+        await update.message.reply_text(user_detail_text(u), reply_markup=user_detail_kb(), parse_mode="HTML")
+        return
+
     # Process broadcast (sends via MAIN bot)
     if st.get("mode") == "broadcast":
         audience = st.get("audience", "all")
-        main_bot = Bot(MAIN_BOT_TOKEN)  # explicit Bot for main token
-
-        if audience == "all":
-            targets = list_user_ids()
-        else:
-            # expired users only: had premium but not currently active
-            targets = []
-            for uid in list_user_ids():
-                u = load_user(uid)
-                prem = u.get("premium", {}) or {}
-                if had_premium_before(prem) and not is_premium_active(prem):
-                    targets.append(uid)
-
         caption = (update.message.caption or "").strip()
         text = (update.message.text or "").strip()
-        sent = 0
-
-        async def send_to(uid: int):
-            nonlocal sent
-            try:
-                if update.message.photo:
-                    file = await context.bot.get_file(update.message.photo[-1].file_id)
-                    temp_dir = Path("./temp")
-                    temp_dir.mkdir(exist_ok=True)
-                    path = temp_dir / f"bc_photo_{secrets.token_hex(4)}.jpg"
-                    await file.download_to_drive(str(path))
-                    with open(path, "rb") as f:
-                        await main_bot.send_photo(uid, photo=f, caption=caption, parse_mode="HTML")
-                    try: path.unlink(missing_ok=True)
-                    except Exception: pass
-                elif update.message.video:
-                    file = await context.bot.get_file(update.message.video.file_id)
-                    temp_dir = Path("./temp")
-                    temp_dir.mkdir(exist_ok=True)
-                    path = temp_dir / f"bc_video_{secrets.token_hex(4)}.mp4"
-                    await file.download_to_drive(str(path))
-                    with open(path, "rb") as f:
-                        await main_bot.send_video(uid, video=f, caption=caption, parse_mode="HTML")
-                    try: path.unlink(missing_ok=True)
-                    except Exception: pass
-                elif update.message.animation:
-                    file = await context.bot.get_file(update.message.animation.file_id)
-                    temp_dir = Path("./temp")
-                    temp_dir.mkdir(exist_ok=True)
-                    path = temp_dir / f"bc_gif_{secrets.token_hex(4)}.mp4"
-                    await file.download_to_drive(str(path))
-                    with open(path, "rb") as f:
-                        await main_bot.send_animation(uid, animation=f, caption=caption, parse_mode="HTML")
-                    try: path.unlink(missing_ok=True)
-                    except Exception: pass
-                elif update.message.document:
-                    file = await context.bot.get_file(update.message.document.file_id)
-                    name = update.message.document.file_name or f"file_{secrets.token_hex(3)}.bin"
-                    temp_dir = Path("./temp")
-                    temp_dir.mkdir(exist_ok=True)
-                    path = temp_dir / name
-                    await file.download_to_drive(str(path))
-                    with open(path, "rb") as f:
-                        await main_bot.send_document(uid, document=f, caption=caption, parse_mode="HTML")
-                    try: path.unlink(missing_ok=True)
-                    except Exception: pass
-                else:
-                    if not text:
-                        return
-                    await main_bot.send_message(uid, text, parse_mode="HTML", disable_web_page_preview=True)
-                sent += 1
-            except BadRequest:
-                pass
-            except Exception:
-                pass
-
-        await update.message.reply_text(f"⏳ Broadcasting to {len(targets)} users...")
-        for uid in targets:
-            await send_to(uid)
-            await asyncio.sleep(0.05)
+        media = broadcast_media_of(update.message)
+        if not media and not text:
+            return
 
+        job_id = await asyncio.to_thread(create_broadcast_job, chat_id, audience, text, caption, media)
         ADMIN_STATE[chat_id] = {}
-        await update.message.reply_text(f"✅ Broadcast done. Sent: {sent}/{len(targets)}", reply_markup=admin_menu_kb())
+        schedule_broadcast_job(context.bot, job_id)
         return
 
 async def errors(update: object, context: ContextTypes.DEFAULT_TYPE):
     traceback.print_exception(type(context.error), context.error, context.error.__traceback__, file=sys.stderr)
 
 def build_app() -> Application:
-    return ApplicationBuilder().token(ADMIN_BOT_TOKEN).concurrent_updates(True).build()
+    return ApplicationBuilder().token(ADMIN_BOT_TOKEN).concurrent_updates(True).post_init(on_startup).post_stop(stop_broadcast_jobs).build()
 
 def main():
     app = build_app()
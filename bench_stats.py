@@ -0,0 +1,100 @@
+# bench_stats.py
+# -----------------------------------------------------------
+# Admin stats benchmark: per-user loads (old build_stats_text) vs the
+# single aggregation in admin.compute_stats, on synthetic users.
+#
+# Uses MONGO_URI from .env and a scratch database "<DB_NAME>_bench",
+# which is dropped afterwards. Nothing in the real database is touched.
+#
+#   python bench_stats.py [USERS]      # default 100000
+# -----------------------------------------------------------
+
+import os
+import sys
+import time
+import random
+
+os.environ.setdefault("ADMIN_BOT_TOKEN", "bench")
+os.environ.setdefault("BOT_TOKEN", "bench")
+BASE_DB = os.getenv("DB_NAME", "SliptBot_db")
+os.environ["DB_NAME"] = f"{BASE_DB}_bench"
+
+import admin  # noqa: E402  (reads DB_NAME at import)
+
+def synthetic_user(uid: int, now: int) -> dict:
+    r = random.random()
+    prem = {"banned": random.random() < 0.03}
+    if r < 0.2:      # active
+        prem.update(active=True, until_ts=now + random.randint(1, 90) * 86400)
+    elif r < 0.45:   # expired
+        prem.update(active=False, until_ts=now - random.randint(1, 90) * 86400)
+    elif r < 0.5:    # legacy string values
+        prem.update(active="yes", until_ts=str(now + 86400))
+    if r < 0.5:
+        prem.update(purchases_total=round(random.uniform(0, 50), 2), purchases_count=random.randint(0, 5))
+    return {
+        "user_id": uid,
+        "premium": prem,
+        "metrics": {"sent_total": random.randint(0, 50000)},
+        "login": {"api_id": None, "api_hash": None, "phone": None},
+        "ad_setup": {"targets": [{"display_id": -1000000000000 - i} for i in range(random.randint(0, 300))]},
+    }
+
+def legacy_stats() -> dict:
+    """The previous build_stats_text loop: one find_one per user"""
+    st = {"total": 0, "banned": 0, "active": 0, "expired": 0, "purchases": 0.0, "sent": 0}
+    coll = admin.users_collection
+    for doc in coll.find({}, {"user_id": 1}):
+        u = coll.find_one({"user_id": doc["user_id"]}) or {}
+        prem = u.get("premium", {}) or {}
+        st["total"] += 1
+        st["banned"] += 1 if prem.get("banned", False) else 0
+        st["purchases"] += float(prem.get("purchases_total", 0.0) or 0.0)
+        st["sent"] += int(u.get("metrics", {}).get("sent_total", 0) or 0)
+        if admin.is_premium_active(prem):
+            st["active"] += 1
+        elif admin.had_premium_before(prem):
+            st["expired"] += 1
+    return st
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    coll = admin.users_collection
+    now = admin.now_ts()
+    random.seed(42)
+
+    coll.delete_many({})
+    print(f"▶️  Seeding {n} synthetic users into {admin.DB_NAME}...")
+    batch = []
+    for uid in range(1, n + 1):
+        batch.append(synthetic_user(uid, now))
+        if len(batch) == 5000:
+            coll.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        coll.insert_many(batch, ordered=False)
+    coll.create_index("user_id", unique=True)
+
+    try:
+        agg, t_agg = timed(admin.compute_stats)
+        old, t_old = timed(legacy_stats)
+
+        agg["purchases"] = round(agg["purchases"], 2)
+        old["purchases"] = round(old["purchases"], 2)
+        print(f"   N+1 loads:    {t_old:8.2f}s  {old}")
+        print(f"   aggregation:  {t_agg:8.2f}s  {agg}")
+        print(f"   speedup:      {t_old / t_agg:8.1f}x")
+        if old != agg:
+            print("⚠️ Results differ")
+            sys.exit(1)
+        print("✅ Results match")
+    finally:
+        admin.mongo_client.drop_database(admin.DB_NAME)
+
+if __name__ == "__main__":
+    main()
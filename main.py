@@ -22,6 +22,11 @@ import traceback
 import importlib
 import importlib.util
 import threading
+import unicodedata
+import itertools
+import math
+from bisect import bisect_left
+from collections import OrderedDict
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple, Union
 
@@ -63,9 +68,8 @@ from telegram.ext import (
 )
 from telegram.error import BadRequest
 
-from telethon import TelegramClient
+from telethon import TelegramClient, events
 from telethon import errors as terr
-from telethon.tl.custom.dialog import Dialog
 from telethon.tl.types import PeerChat, Channel, Chat
 from telethon.errors import (
     SessionPasswordNeededError,
@@ -78,6 +82,8 @@ from telethon.errors import (
 # MongoDB
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
+from pymongo import UpdateOne
+from bson import ObjectId
 import gridfs
 
 # ---------- Config ----------
@@ -92,6 +98,31 @@ MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME", "SliptBot_db")
 
 GROUPS_PAGE_SIZE = int(os.getenv("GROUPS_PAGE_SIZE", "10"))
+PICKER_PAGE_CACHE_SIZE = int(os.getenv("PICKER_PAGE_CACHE_SIZE", "512"))
+PICKER_STATE_CACHE_SIZE = int(os.getenv("PICKER_STATE_CACHE_SIZE", "200"))  # users with a picker kept in memory
+PICKER_STATE_TTL = int(os.getenv("PICKER_STATE_TTL", "1800"))  # idle seconds before a picker is dropped
+TOGGLE_DEBOUNCE = float(os.getenv("TOGGLE_DEBOUNCE", "0.8"))  # quiet window before a toggle burst is saved & rendered
+DIALOG_CHUNK_SIZE = int(os.getenv("DIALOG_CHUNK_SIZE", "200"))
+DEST_REFRESH_INTERVAL = int(os.getenv("DEST_REFRESH_INTERVAL", "1800"))
+TOPIC_FETCH_CONCURRENCY = max(1, int(os.getenv("TOPIC_FETCH_CONCURRENCY", "4")))
+TOPIC_PAGE_SIZE = 100  # server-side maximum for GetForumTopicsRequest
+TOPIC_CACHE_TTL = int(os.getenv("TOPIC_CACHE_TTL", "600"))
+TOPIC_CACHE_SIZE = int(os.getenv("TOPIC_CACHE_SIZE", "2000"))  # forums kept in TOPIC_CACHE
+TOPIC_FETCH_RETRIES = max(1, int(os.getenv("TOPIC_FETCH_RETRIES", "3")))
+TOPIC_FETCH_BACKOFF = float(os.getenv("TOPIC_FETCH_BACKOFF", "1.5"))
+LISTENER_START_CONCURRENCY = max(1, int(os.getenv("LISTENER_START_CONCURRENCY", "8")))
+AUTO_REPLY_CHAT_COOLDOWN = float(os.getenv("AUTO_REPLY_CHAT_COOLDOWN", "30"))  # any reply, per chat
+AUTO_REPLY_KEYWORD_COOLDOWN = float(os.getenv("AUTO_REPLY_KEYWORD_COOLDOWN", "300"))  # same keyword, per chat
+AUTO_REPLY_COOLDOWN_SIZE = int(os.getenv("AUTO_REPLY_COOLDOWN_SIZE", "50000"))
+AUTO_REPLY_PREMIUM_RECHECK = float(os.getenv("AUTO_REPLY_PREMIUM_RECHECK", "60"))  # seconds between premium re-reads per listener
+AUTO_JOIN_CONCURRENCY = max(1, int(os.getenv("AUTO_JOIN_CONCURRENCY", "3")))
+AUTO_JOIN_GAP = float(os.getenv("AUTO_JOIN_GAP", "0.2"))  # per worker, between joins
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "3"))  # min seconds between banner progress edits
+INVITE_CACHE_TTL = int(os.getenv("INVITE_CACHE_TTL", "3600"))
+BROADCAST_CONCURRENCY = max(1, int(os.getenv("BROADCAST_CONCURRENCY", "3")))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "5"))  # sends per second per account
+RECIPIENT_FULL_REFRESH = int(os.getenv("RECIPIENT_FULL_REFRESH", "86400"))  # full rescan; otherwise only recent dialogs
+INVITE_CACHE_SIZE = 10000
 ROUND_DELAY_MIN = int(os.getenv("ROUND_DELAY_MIN", "60"))
 SEND_GAP_MAX = float(os.getenv("SEND_GAP_MAX", "15"))
 BRAND_NAME = os.getenv("BRAND_NAME", "Brand Name")
@@ -133,12 +164,24 @@ db = mongo_client[DB_NAME]
 users_collection = db["users"]
 sessions_collection = db["sessions"]
 logger_data_collection = db["logger_data"]
+destinations_collection = db["destinations"]  # one document per selectable group/topic
+jobs_collection = db["user_jobs"]  # persisted background jobs (auto join, ...)
+recipients_collection = db["recipients"]  # per account: private chats as [id, access_hash] pairs
+memberships_collection = db["memberships"]  # per account: chat ids + lower-case usernames of every dialog
+stats_collection = db["stats"]  # {"_id": "global"}: admin panel counters, reconciled by admin.py
 
 # Create indexes for better performance
 try:
     users_collection.create_index("user_id", unique=True)
     sessions_collection.create_index("user_id", unique=True)
     logger_data_collection.create_index("user_id")
+    destinations_collection.create_index([("user_id", 1), ("display_id", 1)], unique=True)
+    destinations_collection.create_index([("user_id", 1), ("group_type", 1), ("pinned", -1), ("title_lc", 1)])
+    destinations_collection.create_index([("user_id", 1), ("pinned", -1), ("title_lc", 1)])
+    jobs_collection.create_index([("kind", 1), ("status", 1)])
+    jobs_collection.create_index([("user_id", 1), ("kind", 1), ("status", 1)])
+    recipients_collection.create_index("user_id", unique=True)
+    memberships_collection.create_index("user_id", unique=True)
     print("✅ MongoDB indexes created")
 except Exception as e:
     print(f"⚠️ Index creation warning: {e}")
@@ -148,6 +191,23 @@ USERS: Dict[int, Dict[str, Any]] = {}
 AD_TASKS: Dict[int, asyncio.Task] = {}
 ADS_WORKERS: Dict[int, asyncio.Task] = {}
 LOGIN_CLIENTS: Dict[int, TelegramClient] = {}
+CLIENT_POOL: Dict[int, TelegramClient] = {}  # shared connected clients, one per account
+CLIENT_REFS: Dict[int, int] = {}
+CLIENT_LOCKS: Dict[int, asyncio.Lock] = {}
+REPLY_LISTENERS: Dict[int, Tuple[TelegramClient, Any]] = {}  # user_id -> (client, NewMessage handler)
+REPLY_METRICS: Dict[int, Dict[str, float]] = {}  # per-account auto-reply counters
+REPLY_COOLDOWNS: "OrderedDict[Tuple[Any, ...], float]" = OrderedDict()  # (account, chat[, keyword]) -> expires at, LRU
+PREMIUM_CHECKS: Dict[int, float] = {}  # listener user_id -> last premium re-read (monotonic)
+DEST_SYNC_TASKS: Dict[int, asyncio.Task] = {}  # background destination refreshes
+JOB_TASKS: Dict[Tuple[int, str], asyncio.Task] = {}  # (user_id, kind) -> running background job
+RECIPIENT_SYNC_TASKS: Dict[int, asyncio.Task] = {}  # background recipient refreshes
+INVITE_CACHE: Dict[Tuple[int, str], Tuple[float, Optional[bool]]] = {}  # (user, hash) -> (checked_at, already member; None = invalid)
+PICKER_STATES: "OrderedDict[int, Any]" = OrderedDict()  # LRU: user_id -> PickerState
+REPLY_MATCHERS: Dict[int, Tuple[int, Any]] = {}  # user_id -> (pairs rev, KeywordMatcher)
+PICKER_PAGES: "OrderedDict[Tuple[int, str, int, int], InlineKeyboardMarkup]" = OrderedDict()  # LRU of rendered picker pages
+PICKER_FLUSH_TASKS: Dict[int, asyncio.Task] = {}  # pending debounced toggle flushes
+PICKER_VERSIONS = itertools.count(1)  # selection versions, unique across PickerState rebuilds
+TOPIC_CACHE: "OrderedDict[Tuple[Optional[int], int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()  # (user, forum) -> (fetched_at, topics), oldest first
 
 # Steps
 STEP_NONE = "NONE"
@@ -314,11 +374,26 @@ def load_user(user_id: int, force: bool = False) -> Dict[str, Any]:
         "input_msgs": []
     })
     U.setdefault("saved_message_text", None)
-    U.setdefault("group_picker", {"page": 0, "groups": [], "selected_ids": [], "search_filter": ""})
+    gp = U.setdefault("group_picker", {"page": 0, "selected_ids": [], "search_filter": ""})
+    gp.setdefault("search_filter", "")
+    gp.setdefault("scope", None)  # None = groups + topics, or a list of group types
+    gp.setdefault("counts", {"group": 0, "topic": 0})
+    if "groups" in gp:
+        # Destinations live in their own collection now; they are re-collected on the next sync
+        gp.pop("groups", None)
+        try:
+            users_collection.update_one({"user_id": user_id}, {"$unset": {"group_picker.groups": ""}})
+        except Exception:
+            pass
     U.setdefault("premium", {"active": False, "until_ts": 0, "purchases_total": 0.0, "purchases_count": 0, "banned": False})
     U.setdefault("metrics", {"sent_total": 0})
     return U
 
+# Written only with targeted updates (premium and bot_blocked* by the admin bot,
+# ads_running by the ads worker); never $set back from the possibly stale cached
+# copy, or a concurrent change would be lost.
+TARGETED_FIELDS = ("premium", "bot_blocked", "bot_blocked_at", "ads_running")
+
 def save_user(user_id: int):
     """Save user data to MongoDB"""
     if user_id not in USERS:
@@ -327,16 +402,42 @@ def save_user(user_id: int):
         user_data = USERS[user_id].copy()
         user_data["user_id"] = user_id  # Ensure user_id is in document
         user_data["updated_at"] = time.time()
-        
+        on_insert = {"premium": user_data.get("premium")}
+        for k in TARGETED_FIELDS:
+            user_data.pop(k, None)
+
         # Upsert to MongoDB
-        users_collection.update_one(
+        res = users_collection.update_one(
             {"user_id": user_id},
-            {"$set": user_data},
+            {"$set": user_data, "$setOnInsert": on_insert},
             upsert=True
         )
+        if res.upserted_id is not None:
+            bump_stats({"total": 1})
     except Exception as e:
         print(f"⚠️ MongoDB save error for user {user_id}: {e}")
 
+def clear_bot_blocked(user_id: int):
+    """User is back: let admin broadcasts reach them again"""
+    try:
+        users_collection.update_one({"user_id": user_id}, {"$unset": {"bot_blocked": "", "bot_blocked_at": ""}})
+    except Exception as e:
+        print(f"⚠️ MongoDB save error for user {user_id}: {e}")
+
+def set_ads_running(user_id: int, running: bool):
+    """Persist whether a campaign is running, for the admin bot's user browser"""
+    try:
+        users_collection.update_one({"user_id": user_id}, {"$set": {"ads_running": running}})
+    except Exception as e:
+        print(f"⚠️ MongoDB save error for user {user_id}: {e}")
+
+def bump_stats(inc: Dict[str, float]):
+    """Atomic update of the materialized admin stats document"""
+    try:
+        stats_collection.update_one({"_id": "global"}, {"$inc": inc}, upsert=True)
+    except Exception as e:
+        print(f"⚠️ MongoDB stats update error: {e}")
+
 def premium_active(u: Dict[str, Any]) -> bool:
     return int(u.get("premium", {}).get("until_ts", 0) or 0) > int(time.time())
 
@@ -353,12 +454,66 @@ def set_last_msg(user: Dict[str, Any], chat_id: int, message_id: int, is_photo:
 def sfile(base: str) -> Path:
     return Path(base + ".session")
 
-def get_final_client(user_id: int) -> Optional[TelegramClient]:
+def has_session(user_id: int) -> bool:
+    """Logged in: API credentials and a session file, without opening a client"""
     u = load_user(user_id)
-    api_id, api_hash, base = u["login"]["api_id"], u["login"]["api_hash"], u["session_base"]
-    if not api_id or not api_hash or not sfile(base).exists():
+    return bool(u["login"]["api_id"] and u["login"]["api_hash"] and sfile(u["session_base"]).exists())
+
+def get_final_client(user_id: int) -> Optional[TelegramClient]:
+    if not has_session(user_id):
         return None
-    return TelegramClient(base, api_id, api_hash)
+    u = load_user(user_id)
+    return TelegramClient(u["session_base"], u["login"]["api_id"], u["login"]["api_hash"])
+
+# ---------- Shared Telethon clients ----------
+async def acquire_client(user_id: int) -> Optional[TelegramClient]:
+    """Connected client for the account, shared by ads, syncs, tools and the auto-reply listener"""
+    lock = CLIENT_LOCKS.setdefault(user_id, asyncio.Lock())
+    async with lock:
+        client = CLIENT_POOL.get(user_id)
+        if client is None:
+            client = get_final_client(user_id)
+            if client is None:
+                return None
+            CLIENT_POOL[user_id] = client
+        if not client.is_connected():
+            await client.connect()
+        CLIENT_REFS[user_id] = CLIENT_REFS.get(user_id, 0) + 1
+        return client
+
+async def release_client(user_id: int, client: TelegramClient):
+    """Drop one reference; the last holder disconnects. A holder of a client that
+    drop_client() already replaced is ignored, so it cannot touch the new one."""
+    lock = CLIENT_LOCKS.setdefault(user_id, asyncio.Lock())
+    async with lock:
+        if CLIENT_POOL.get(user_id) is not client:
+            return
+        refs = CLIENT_REFS.get(user_id, 0) - 1
+        if refs > 0:
+            CLIENT_REFS[user_id] = refs
+            return
+        CLIENT_REFS.pop(user_id, None)
+        CLIENT_POOL.pop(user_id, None)
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+async def drop_client(user_id: int):
+    """Forget the pooled client regardless of holders (session file replaced or removed)"""
+    lock = CLIENT_LOCKS.setdefault(user_id, asyncio.Lock())
+    async with lock:
+        CLIENT_REFS.pop(user_id, None)
+        client = CLIENT_POOL.pop(user_id, None)
+        if client is not None:
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+
+async def close_client_pool(app: Application = None):
+    for user_id in list(CLIENT_POOL):
+        await drop_client(user_id)
 
 def cleanup_tmp(user_id: int):
     c = LOGIN_CLIENTS.pop(user_id, None)
@@ -394,6 +549,300 @@ def finalize_tmp_to_final(user_id: int):
     u["login"]["tmp_base"] = None
     save_user(user_id)
 
+# ---------- Destinations storage ----------
+PICKER_TYPES = ["group", "topic"]  # forum containers are never stored, only their topics
+DESTINATION_PROJECTION = {"_id": 0, "display_id": 1, "title": 1, "group_type": 1}
+DESTINATION_SORT = [("pinned", -1), ("title_lc", 1)]  # pinned first, then alphabetically
+
+def picker_types(gp: Dict[str, Any]) -> List[str]:
+    return gp.get("scope") or PICKER_TYPES
+
+def destination_query(user_id: int, types: Optional[List[str]] = None, search: str = "") -> Dict[str, Any]:
+    query: Dict[str, Any] = {"user_id": user_id, "group_type": {"$in": types or PICKER_TYPES}}
+    if search:
+        query["title_lc"] = {"$regex": re.escape(search.lower())}
+    return query
+
+def count_destinations(user_id: int, types: Optional[List[str]] = None, search: str = "", extra: Optional[Dict[str, Any]] = None) -> int:
+    try:
+        return destinations_collection.count_documents({**destination_query(user_id, types, search), **(extra or {})})
+    except Exception as e:
+        print(f"⚠️ MongoDB destinations count error for user {user_id}: {e}")
+        return 0
+
+def load_destinations(user_id: int, types: Optional[List[str]] = None, search: str = "") -> List[Dict[str, Any]]:
+    """All projected destinations matching types/search, in display order"""
+    try:
+        return list(destinations_collection.find(destination_query(user_id, types, search), DESTINATION_PROJECTION).sort(DESTINATION_SORT))
+    except Exception as e:
+        print(f"⚠️ MongoDB destinations load error for user {user_id}: {e}")
+        return []
+
+def destination_ids(user_id: int, types: Optional[List[str]] = None, search: str = "") -> List[Union[int, str]]:
+    return [d["display_id"] for d in load_destinations(user_id, types, search)]
+
+def normalize_title(text: str) -> str:
+    """Lower-case, accent-free, alphanumeric-only form of a title ("📁 Café Crème" -> "cafe creme")"""
+    out = []
+    for ch in unicodedata.normalize("NFKD", text or ""):
+        cat = unicodedata.category(ch)
+        if cat == "Mn":
+            continue  # combining accent
+        out.append(ch if cat[0] in ("L", "N") else " ")
+    return " ".join("".join(out).casefold().split())
+
+def _trigrams(norm: str) -> List[str]:
+    padded = f" {norm} "
+    return [padded[i:i+3] for i in range(len(padded) - 2)]
+
+class TitleIndex:
+    """Trigram index over normalized titles.
+
+    search() returns exact substring matches only, so a filtered view (and the
+    bulk actions on it) never contains unrelated chats: word-prefix matches
+    first, then by the share of the padded query trigrams present (whole-word
+    hits above mid-word ones). suggest() is the typo-tolerant part, for "did
+    you mean" hints. Ties keep the original display order. Postings are
+    ascending positions, so they double as sorted lists for membership probes.
+    """
+
+    MIN_OVERLAP = 0.5  # suggestions only; never part of a filtered view
+
+    def __init__(self, items: List[Tuple[Union[int, str], str]]):
+        self.ids: List[Union[int, str]] = []
+        self.norm: List[str] = []
+        self.grams: Dict[str, List[int]] = {}
+        for pos, (disp_id, title) in enumerate(items):
+            n = normalize_title(title)
+            self.ids.append(disp_id)
+            self.norm.append(n)
+            for g in set(_trigrams(n)):
+                self.grams.setdefault(g, []).append(pos)
+
+    def _has(self, g: str, pos: int) -> bool:
+        postings = self.grams.get(g)
+        if not postings:
+            return False
+        i = bisect_left(postings, pos)
+        return i < len(postings) and postings[i] == pos
+
+    def _overlap(self, pos: int, qgrams: List[str]) -> float:
+        return sum(1 for g in qgrams if self._has(g, pos)) / len(qgrams)
+
+    def _score(self, pos: int, q: str, qgrams: List[str]) -> float:
+        n = self.norm[pos]
+        prefix = 1.0 if n.startswith(q) or f" {q}" in n else 0.0
+        return prefix + self._overlap(pos, qgrams)
+
+    def _substring_hits(self, q: str) -> List[int]:
+        inner = sorted({q[i:i+3] for i in range(len(q) - 2)}, key=lambda g: len(self.grams.get(g, ())))
+        if not inner:
+            # Too short for trigrams: plain substring scan over normalized titles
+            return [pos for pos, n in enumerate(self.norm) if q in n]
+        # Every title containing q contains all of q's inner trigrams: walk the
+        # rarest posting list, probe the others, then confirm the substring.
+        rest = inner[1:]
+        return [pos for pos in self.grams.get(inner[0], ())
+                if all(self._has(g, pos) for g in rest) and q in self.norm[pos]]
+
+    def search(self, query: str) -> List[Union[int, str]]:
+        q = normalize_title(query)
+        if not q:
+            return list(self.ids)
+        qgrams = list(set(_trigrams(q)))
+        hits = [(self._score(pos, q, qgrams), pos) for pos in self._substring_hits(q)]
+        hits.sort(key=lambda h: (-h[0], h[1]))
+        return [self.ids[pos] for _, pos in hits]
+
+    def suggest(self, query: str, limit: int = 3) -> List[Union[int, str]]:
+        """Close but inexact matches: titles sharing >= MIN_OVERLAP of the query trigrams"""
+        q = normalize_title(query)
+        if len(q) < 3:
+            return []
+        # Any title sharing >= need trigrams must contain one of the rarest
+        # (len - need + 1) of them: collect candidates from those postings only.
+        qgrams = sorted(set(_trigrams(q)), key=lambda g: len(self.grams.get(g, ())))
+        need = max(1, math.ceil(len(qgrams) * self.MIN_OVERLAP))
+        candidates = set()
+        for g in qgrams[:len(qgrams) - need + 1]:
+            candidates.update(self.grams.get(g, ()))
+        hits = []
+        for pos in candidates:
+            if q in self.norm[pos]:
+                continue
+            overlap = self._overlap(pos, qgrams)
+            if overlap * len(qgrams) >= need:
+                hits.append((overlap, pos))
+        hits.sort(key=lambda h: (-h[0], h[1]))
+        return [self.ids[pos] for _, pos in hits[:limit]]
+
+class PickerState:
+    """In-memory picker for one user: destinations in display order, a title
+    search index, the selection in tap order (an insertion-ordered dict, so
+    selected_ids keep the order the user picked them), filtered views cached
+    per search string and per-view selected counts kept up to date on every toggle."""
+
+    def __init__(self, user_id: int, types: List[str], synced_at: Any, selected: List[Union[int, str]]):
+        self.key = (tuple(types), synced_at)
+        self.order: List[Union[int, str]] = []
+        self.titles: Dict[Union[int, str], str] = {}
+        self._by_type: Dict[str, set] = {}
+        for d in load_destinations(user_id, types):
+            self.order.append(d["display_id"])
+            self.titles[d["display_id"]] = d["title"]
+            self._by_type.setdefault(d["group_type"], set()).add(d["display_id"])
+        self.index = TitleIndex([(i, self.titles[i]) for i in self.order])
+        self.selected: Dict[Union[int, str], None] = dict.fromkeys(selected)
+        self.version = next(PICKER_VERSIONS)  # bumped on every selection change
+        self.used_at = time.time()
+        self._rows: Dict[Union[int, str], InlineKeyboardButton] = {}  # rendered row buttons
+        self._views: Dict[str, Tuple[List[Union[int, str]], set]] = {}
+        self._view_selected: Dict[str, int] = {}
+
+    def view(self, search: str = "") -> List[Union[int, str]]:
+        """Display ids matching ``search``, best matches first (cached per search string)"""
+        cached = self._views.get(search)
+        if cached is None:
+            ids = self.index.search(search) if search else self.order
+            cached = (ids, set(ids))
+            self._views[search] = cached
+            self._view_selected[search] = len(cached[1] & self.selected.keys())
+        return cached[0]
+
+    def view_set(self, search: str = "") -> set:
+        self.view(search)
+        return self._views[search][1]
+
+    def selected_in_view(self, search: str = "") -> int:
+        self.view(search)
+        return self._view_selected[search]
+
+    def row_button(self, disp_id: Union[int, str]) -> InlineKeyboardButton:
+        """Rendered row for one destination, rebuilt only after its checkmark changed"""
+        button = self._rows.get(disp_id)
+        if button is None:
+            mark = "✅" if disp_id in self.selected else "☐"
+            title = self.titles[disp_id]
+            # Truncate long titles for better display
+            if len(title) > 35:
+                title = title[:32] + "..."
+            button = InlineKeyboardButton(f"{mark} {title}", callback_data=f"toggle_group:{disp_id}")
+            self._rows[disp_id] = button
+        return button
+
+    def _bump(self, disp_id: Union[int, str], delta: int):
+        for search, (_, members) in self._views.items():
+            if disp_id in members:
+                self._view_selected[search] += delta
+        self._rows.pop(disp_id, None)
+        self.version = next(PICKER_VERSIONS)
+
+    def toggle(self, disp_id: Union[int, str]) -> bool:
+        """Flip one destination; returns True when it is now selected"""
+        if disp_id in self.selected:
+            del self.selected[disp_id]
+            self._bump(disp_id, -1)
+            return False
+        self.selected[disp_id] = None
+        self._bump(disp_id, 1)
+        return True
+
+    def type_set(self, group_type: str) -> set:
+        return self._by_type.get(group_type, set())
+
+    def add_many(self, ids: set) -> set:
+        """Union ``ids`` into the selection (appended in display order); returns the newly selected ids"""
+        added = ids - self.selected.keys()
+        if added:
+            self.selected.update(dict.fromkeys(i for i in self.order if i in added))
+            for search, (_, members) in self._views.items():
+                self._view_selected[search] += len(added & members)
+            self._drop_rows(added)
+            self.version = next(PICKER_VERSIONS)
+        return added
+
+    def remove_many(self, ids: set) -> set:
+        """Remove ``ids`` from the selection; returns the ids actually removed"""
+        removed = ids & self.selected.keys()
+        if removed:
+            for disp_id in removed:
+                del self.selected[disp_id]
+            for search, (_, members) in self._views.items():
+                self._view_selected[search] -= len(removed & members)
+            self._drop_rows(removed)
+            self.version = next(PICKER_VERSIONS)
+        return removed
+
+    def _drop_rows(self, ids: set):
+        if len(ids) > len(self._rows):
+            self._rows = {i: b for i, b in self._rows.items() if i not in ids}
+        else:
+            for disp_id in ids:
+                self._rows.pop(disp_id, None)
+
+    def selected_list(self) -> List[Union[int, str]]:
+        return list(self.selected)
+
+def picker_state(user_id: int) -> PickerState:
+    """Cached PickerState, rebuilt when the scope changes or destinations were re-synced"""
+    gp = load_user(user_id)["group_picker"]
+    types = picker_types(gp)
+    state = PICKER_STATES.get(user_id)
+    if state is None or state.key != (tuple(types), gp.get("synced_at")):
+        state = PickerState(user_id, types, gp.get("synced_at"), gp.get("selected_ids", []))
+        PICKER_STATES[user_id] = state
+    PICKER_STATES.move_to_end(user_id)
+    state.used_at = time.time()
+    prune_picker_states()
+    return state
+
+def prune_picker_states():
+    """Drop least recently used pickers beyond PICKER_STATE_CACHE_SIZE or idle for PICKER_STATE_TTL;
+    a picker with a pending toggle flush is kept until that write happens"""
+    now = time.time()
+    for uid in list(PICKER_STATES):
+        if len(PICKER_STATES) <= PICKER_STATE_CACHE_SIZE and now - PICKER_STATES[uid].used_at < PICKER_STATE_TTL:
+            break
+        if uid not in PICKER_FLUSH_TASKS:
+            del PICKER_STATES[uid]
+
+def invalidate_picker_state(user_id: int):
+    PICKER_STATES.pop(user_id, None)
+
+def save_picker_selection(user_id: int, state: PickerState):
+    """Persist the picker selection (one write)"""
+    load_user(user_id)["group_picker"]["selected_ids"] = state.selected_list()
+    save_user(user_id)
+
+def schedule_picker_flush(user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    """(Re)start the quiet window; the last toggle of a burst does the write and the edit"""
+    task = PICKER_FLUSH_TASKS.get(user_id)
+    if task and not task.done():
+        task.cancel()
+    PICKER_FLUSH_TASKS[user_id] = asyncio.create_task(_flush_picker_later(user_id, context))
+
+async def _flush_picker_later(user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.sleep(TOGGLE_DEBOUNCE)
+    PICKER_FLUSH_TASKS.pop(user_id, None)
+    state = PICKER_STATES.get(user_id)
+    if state is None:
+        return
+    save_picker_selection(user_id, state)
+    try:
+        await show_group_picker(user_id, context)
+    except Exception as e:
+        print(f"⚠️ Picker refresh failed for {user_id}: {e}")
+
+def flush_pending_toggles(user_id: int):
+    """Write a pending toggle burst now, before another handler reads the user document"""
+    task = PICKER_FLUSH_TASKS.pop(user_id, None)
+    if task is None:
+        return
+    task.cancel()
+    state = PICKER_STATES.get(user_id)
+    if state is not None:
+        save_picker_selection(user_id, state)
+
 # ---------- String sanitizers (fix for inline .env comments/spaces) ----------
 def _sanitize_tg_handle_or_path(raw: Optional[str]) -> str:
     """
@@ -645,49 +1094,49 @@ def otp_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 def group_picker_kb(user_id: int) -> InlineKeyboardMarkup:
-    u = load_user(user_id)
-    gp = u["group_picker"]
+    """Picker page keyboard, served from PICKER_PAGES while (filter, page, selection version) is unchanged"""
+    gp = load_user(user_id)["group_picker"]
     page = gp["page"]
-    groups = gp["groups"]
-    selected = set(gp["selected_ids"])
+    state = picker_state(user_id)
     search_filter = gp.get("search_filter", "").lower()
+
+    cache_key = (user_id, search_filter, page, state.version)
+    kb = PICKER_PAGES.get(cache_key)
+    if kb is not None:
+        PICKER_PAGES.move_to_end(cache_key)
+        return kb
     
-    # Filter out forum groups - only show regular groups and topics
-    non_forum_groups = [g for g in groups if g.get("group_type") != "forum"]
-    
-    # Apply search filter if present
-    if search_filter:
-        filtered_groups = [g for g in non_forum_groups if search_filter in g["title"].lower()]
-    else:
-        filtered_groups = non_forum_groups
-    
+    view = state.view(search_filter)
     per_page = GROUPS_PAGE_SIZE
     start = page * per_page
-    page_items = filtered_groups[start:start+per_page]
+    page_items = view[start:start+per_page]
+    total_groups = len(view)
 
     rows: List[List[InlineKeyboardButton]] = []
     
     # Show search status if active
     if search_filter:
-        rows.append([InlineKeyboardButton(f"🔍 Filter: '{search_filter}' ({len(filtered_groups)} results)", callback_data="clear_filter")])
+        rows.append([InlineKeyboardButton(f"🔍 Filter: '{search_filter}' ({total_groups} results)", callback_data="clear_filter")])
     
     # Show selection count
-    total_groups = len(filtered_groups)
-    selected_count = len([g for g in filtered_groups if g["display_id"] in selected])
+    selected_count = state.selected_in_view(search_filter)
     rows.append([InlineKeyboardButton(f"📊 Selected: {selected_count}/{total_groups}", callback_data="show_selection_count")])
     
-    for item in page_items:
-        mark = "✅" if item["display_id"] in selected else "☐"
-        title = item['title']
-        # Truncate long titles for better display
-        if len(title) > 35:
-            title = title[:32] + "..."
-        rows.append([InlineKeyboardButton(f"{mark} {title}", callback_data=f"toggle_group:{item['display_id']}")])
+    # Unchanged rows are reused from the state's row cache
+    for disp_id in page_items:
+        rows.append([state.row_button(disp_id)])
+
+    # Nothing matched exactly: offer close titles, outside the filtered view
+    if search_filter and not view:
+        suggestions = state.index.suggest(search_filter)
+        if suggestions:
+            rows.append([InlineKeyboardButton("💡 Did you mean:", callback_data="noop")])
+            rows.extend([state.row_button(disp_id)] for disp_id in suggestions)
 
     # Navigation row
     nav_row: List[InlineKeyboardButton] = []
     if page > 0: nav_row.append(InlineKeyboardButton("⬅️ Back", callback_data="page_back"))
-    if start + per_page < len(filtered_groups): nav_row.append(InlineKeyboardButton("➡️ Next", callback_data="page_next"))
+    if start + per_page < total_groups: nav_row.append(InlineKeyboardButton("➡️ Next", callback_data="page_next"))
     if nav_row: rows.append(nav_row)
     
     # Select/Unselect All row
@@ -704,7 +1153,11 @@ def group_picker_kb(user_id: int) -> InlineKeyboardMarkup:
     action_row.append(InlineKeyboardButton("✅ Continue", callback_data="picker_continue"))
     rows.append(action_row)
     
-    return InlineKeyboardMarkup(rows)
+    kb = InlineKeyboardMarkup(rows)
+    PICKER_PAGES[cache_key] = kb
+    if len(PICKER_PAGES) > PICKER_PAGE_CACHE_SIZE:
+        PICKER_PAGES.popitem(last=False)
+    return kb
 
 WELCOME_CAPTION = (
     "🎉 Welcome!\n"
@@ -866,6 +1319,20 @@ async def edit_banner_strict(user_id: int, context: ContextTypes.DEFAULT_TYPE, n
     except Exception:
         pass
 
+async def edit_banner_progress(user_id: int, bot, new_caption: str, keyboard: Optional[InlineKeyboardMarkup] = None):
+    """Best-effort banner edit for background progress (uses the cached user, never reloads)"""
+    u = load_user(user_id)
+    chat_id, message_id, is_photo = get_last_msg(u)
+    if not chat_id or not message_id:
+        return
+    try:
+        if is_photo:
+            await safe_edit_caption(bot, chat_id, message_id, new_caption, reply_markup=keyboard)
+        else:
+            await safe_edit_text(bot, chat_id, message_id, new_caption, reply_markup=keyboard)
+    except Exception:
+        pass
+
 async def send_new_banner_text(user_id: int, context: ContextTypes.DEFAULT_TYPE, caption: str, keyboard: InlineKeyboardMarkup):
     u = load_user(user_id)
     chat_id, _, _ = get_last_msg(u)
@@ -1021,6 +1488,7 @@ def _ensure_features_dict(u: Dict[str, Any]) -> Dict[str, Any]:
     return f
 
 PAIR_LINE_RE = re.compile(r"^\s*(.+?)\s*(?:->|:)\s*(.+?)\s*$")
+PAIR_KEYWORD_RE = re.compile(r"^(=)?\s*(.+?)(?:\s+!(-?\d+))?$")  # "=word !2" -> whole word, priority 2
 
 def parse_pairs(blob: str) -> List[Tuple[str, str]]:
     pairs: List[Tuple[str, str]] = []
@@ -1034,13 +1502,247 @@ def parse_pairs(blob: str) -> List[Tuple[str, str]]:
             pairs.append((k, v))
     return pairs
 
-def find_reply(pairs: List[Dict[str, str]], text: str) -> Optional[str]:
-    t = (text or "").lower()
-    for p in pairs:
-        kw = (p.get("kw") or "").lower()
-        if kw and kw in t:
-            return p.get("reply") or ""
-    return None
+def build_pair(k: str, v: str) -> Dict[str, Any]:
+    """Stored pair from a parsed line; options are only kept when set"""
+    m = PAIR_KEYWORD_RE.match(k)
+    pair: Dict[str, Any] = {"kw": m.group(2), "reply": v}
+    if m.group(1):
+        pair["word"] = True
+    if m.group(3):
+        pair["priority"] = int(m.group(3))
+    return pair
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over one user's auto-reply keywords.
+
+    ``match`` makes a single pass over the lower-cased text. The highest
+    ``priority`` wins; ties go to the pair added first."""
+
+    def __init__(self, pairs: List[Dict[str, Any]]):
+        self.pairs = pairs
+        self.lengths: List[int] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.out: List[List[int]] = [[]]
+        for idx, p in enumerate(pairs):
+            kw = (p.get("kw") or "").lower()
+            self.lengths.append(len(kw))
+            if not kw:
+                continue
+            node = 0
+            for ch in kw:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(idx)
+
+        # Failure links, breadth first; outputs are merged along them
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        t = (text or "").lower()
+        goto, fail, out = self.goto, self.fail, self.out
+        best: Optional[Tuple[int, int]] = None
+        node = 0
+        for i, ch in enumerate(t):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                p = self.pairs[idx]
+                if p.get("word"):
+                    start, end = i + 1 - self.lengths[idx], i + 1
+                    if (start > 0 and _is_word_char(t[start - 1])) or (end < len(t) and _is_word_char(t[end])):
+                        continue
+                rank = (p.get("priority", 0), -idx)
+                if best is None or rank > best:
+                    best = rank
+        if best is None:
+            return None
+        return self.pairs[-best[1]]
+
+def find_reply(user_id: int, ar: Dict[str, Any], text: str) -> Optional[Dict[str, Any]]:
+    """Match ``text`` against the user's pairs; the automaton is rebuilt only when ``ar["rev"]`` changes"""
+    rev = ar.get("rev", 0)
+    cached = REPLY_MATCHERS.get(user_id)
+    if cached is None or cached[0] != rev:
+        cached = (rev, KeywordMatcher(ar.get("pairs", [])))
+        REPLY_MATCHERS[user_id] = cached
+    return cached[1].match(text)
+
+# ---------- Auto-reply listeners ----------
+def reply_cooling_down(key: Tuple[Any, ...]) -> bool:
+    expires = REPLY_COOLDOWNS.get(key)
+    if expires is None:
+        return False
+    if expires > time.monotonic():
+        return True
+    del REPLY_COOLDOWNS[key]
+    return False
+
+def start_reply_cooldown(user_id: int, chat_id: int, kw: str):
+    """Arm the per-chat and per-keyword cooldowns; oldest entries are evicted past AUTO_REPLY_COOLDOWN_SIZE"""
+    now = time.monotonic()
+    for key, ttl in (((user_id, chat_id), AUTO_REPLY_CHAT_COOLDOWN), ((user_id, chat_id, kw), AUTO_REPLY_KEYWORD_COOLDOWN)):
+        if ttl > 0:
+            REPLY_COOLDOWNS[key] = now + ttl
+            REPLY_COOLDOWNS.move_to_end(key)
+    while len(REPLY_COOLDOWNS) > AUTO_REPLY_COOLDOWN_SIZE:
+        REPLY_COOLDOWNS.popitem(last=False)
+
+async def refresh_premium(user_id: int):
+    """Re-read the premium field at most every AUTO_REPLY_PREMIUM_RECHECK seconds, so an
+    admin revoke stops the listener without waiting for the user to open the bot"""
+    now = time.monotonic()
+    checked = PREMIUM_CHECKS.get(user_id)
+    if checked is not None and now - checked < AUTO_REPLY_PREMIUM_RECHECK:
+        return
+    PREMIUM_CHECKS[user_id] = now
+    try:
+        doc = await asyncio.to_thread(users_collection.find_one, {"user_id": user_id}, {"_id": 0, "premium": 1})
+    except Exception as e:
+        print(f"⚠️ MongoDB premium check error for user {user_id}: {e}")
+        return
+    if doc is not None and user_id in USERS:
+        USERS[user_id]["premium"] = doc.get("premium") or {}
+
+def _new_reply_metrics() -> Dict[str, float]:
+    return {"seen": 0, "replies": 0, "suppressed": 0, "errors": 0, "cpu_ms": 0.0, "latency_ms_avg": 0.0, "latency_ms_max": 0.0}
+
+def _reply_handler(user_id: int):
+    async def handler(event):
+        started = time.perf_counter()
+        await refresh_premium(user_id)
+        cpu_started = time.thread_time()
+        m = REPLY_METRICS.setdefault(user_id, _new_reply_metrics())
+        m["seen"] += 1
+        u = load_user(user_id)
+        ar = u.get("features", {}).get("auto_reply", {})
+        if not ar.get("enabled") or not allowed_to_use(user_id, u):
+            asyncio.create_task(stop_reply_listener(user_id))
+            return
+        text = event.raw_text
+        chat_id = event.chat_id
+        if not text or reply_cooling_down((user_id, chat_id)):
+            m["cpu_ms"] += (time.thread_time() - cpu_started) * 1000
+            return
+        pair = find_reply(user_id, ar, text)
+        reply = (pair or {}).get("reply")
+        if reply and reply_cooling_down((user_id, chat_id, pair["kw"].lower())):
+            m["suppressed"] += 1
+            reply = None
+        elif reply:
+            start_reply_cooldown(user_id, chat_id, pair["kw"].lower())
+        m["cpu_ms"] += (time.thread_time() - cpu_started) * 1000
+        if not reply:
+            return
+        try:
+            await event.reply(reply, link_preview=False)
+        except FloodWaitError as e:
+            m["errors"] += 1
+            print(f"⚠️ Auto-reply flood wait for {user_id}: {e.seconds}s")
+            return
+        except Exception as e:
+            m["errors"] += 1
+            print(f"⚠️ Auto-reply failed for {user_id}: {e}")
+            return
+        latency = (time.perf_counter() - started) * 1000
+        m["replies"] += 1
+        m["latency_ms_avg"] += (latency - m["latency_ms_avg"]) / m["replies"]
+        m["latency_ms_max"] = max(m["latency_ms_max"], latency)
+    return handler
+
+async def start_reply_listener(user_id: int) -> bool:
+    """Attach a NewMessage handler to the account's shared client (DMs and groups)"""
+    if user_id in REPLY_LISTENERS:
+        return True
+    client = await acquire_client(user_id)
+    if client is None:
+        return False
+    try:
+        authorized = await client.is_user_authorized()
+    except Exception:
+        authorized = False
+    if not authorized or user_id in REPLY_LISTENERS:
+        await release_client(user_id, client)
+        return authorized
+    handler = _reply_handler(user_id)
+    client.add_event_handler(handler, events.NewMessage(incoming=True))
+    REPLY_LISTENERS[user_id] = (client, handler)
+    REPLY_METRICS.setdefault(user_id, _new_reply_metrics())
+    return True
+
+async def stop_reply_listener(user_id: int):
+    PREMIUM_CHECKS.pop(user_id, None)
+    entry = REPLY_LISTENERS.pop(user_id, None)
+    if entry is None:
+        return
+    client, handler = entry
+    client.remove_event_handler(handler)
+    await release_client(user_id, client)
+
+async def ensure_reply_listener(user_id: int) -> bool:
+    """Run the listener exactly when auto reply is enabled and the user may use it"""
+    u = load_user(user_id)
+    ar = u.get("features", {}).get("auto_reply", {})
+    if ar.get("enabled") and allowed_to_use(user_id, u):
+        return await start_reply_listener(user_id)
+    await stop_reply_listener(user_id)
+    return False
+
+async def start_reply_listeners(app: Application = None):
+    """On startup: reattach listeners for every account with auto reply enabled"""
+    try:
+        user_ids = [d["user_id"] for d in users_collection.find({"features.auto_reply.enabled": True}, {"user_id": 1})]
+    except Exception as e:
+        print(f"⚠️ MongoDB auto-reply lookup error: {e}")
+        return
+    sem = asyncio.Semaphore(LISTENER_START_CONCURRENCY)
+
+    async def start_one(uid: int) -> bool:
+        async with sem:
+            try:
+                return await ensure_reply_listener(uid)
+            except Exception as e:
+                print(f"⚠️ Auto-reply listener failed to start for {uid}: {e}")
+                return False
+
+    started = await asyncio.gather(*(start_one(uid) for uid in user_ids))
+    print(f"✅ Auto-reply listeners running for {sum(started)}/{len(user_ids)} accounts")
+
+def reply_listener_status(user_id: int) -> str:
+    if user_id not in REPLY_LISTENERS:
+        return "Listener: ⚪ stopped"
+    m = REPLY_METRICS.get(user_id) or _new_reply_metrics()
+    return (
+        f"Listener: 🟢 running\n"
+        f"Seen {int(m['seen'])} • Replied {int(m['replies'])} • Cooled down {int(m['suppressed'])} • Errors {int(m['errors'])}\n"
+        f"Latency avg {m['latency_ms_avg']:.0f} ms (max {m['latency_ms_max']:.0f} ms) • CPU {m['cpu_ms']:.1f} ms"
+    )
+
+async def _on_startup(app: Application):
+    try:  # campaigns don't survive a restart
+        users_collection.update_many({"ads_running": True}, {"$set": {"ads_running": False}})
+    except Exception as e:
+        print(f"⚠️ MongoDB reset error: {e}")
+    app.create_task(start_reply_listeners(app))
+    app.create_task(resume_jobs(app))
 
 def split_targets(raw: str) -> List[str]:
     items = []
@@ -1067,6 +1769,525 @@ def parse_join_target(token: str) -> Dict[str, Any]:
         return {"type": "username", "value": m3.group(1)}
     return {"type": "username", "value": t.lstrip("@")}
 
+def join_label(token: str, t: Dict[str, Any]) -> str:
+    return token if token.startswith("@") else (f"@{t['value']}" if t["type"] == "username" else str(token))
+
+def join_key(t: Dict[str, Any]) -> Tuple[str, Any]:
+    """Canonical identity of a join target, used to drop duplicate tokens"""
+    if t["type"] == "invite":
+        return ("invite", t["hash"])
+    if t["type"] == "username":
+        return ("username", t["value"].lower())
+    return ("id", t["value"])
+
+def membership_keys(chat_id: Optional[int], username: Optional[str]) -> List[Any]:
+    keys: List[Any] = [chat_id] if chat_id is not None else []
+    if username:
+        keys.append(username.lower())
+    return keys
+
+def save_memberships(user_id: int, members: set, scanned_at: float):
+    try:
+        memberships_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"keys": list(members), "scanned_at": scanned_at}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"⚠️ MongoDB memberships write error for user {user_id}: {e}")
+
+def known_memberships(user_id: int) -> set:
+    """Chats the account is in (groups, forums and channels): the last dialog scan,
+    else the stored destinations for accounts not scanned since memberships were kept"""
+    members: set = set()
+    try:
+        doc = memberships_collection.find_one({"user_id": user_id}, {"_id": 0, "keys": 1})
+        if doc is not None:
+            return set(doc.get("keys", []))
+        for d in destinations_collection.find({"user_id": user_id}, {"_id": 0, "display_id": 1, "parent_group": 1, "username": 1}):
+            if d.get("parent_group") is not None:
+                members.add(d["parent_group"])
+            else:
+                members.update(membership_keys(d["display_id"], d.get("username")))
+    except Exception as e:
+        print(f"⚠️ MongoDB membership lookup error for user {user_id}: {e}")
+    return members
+
+def already_member(members: set, t: Dict[str, Any]) -> bool:
+    if t["type"] == "username":
+        return t["value"].lower() in members
+    if t["type"] == "id":
+        return t["value"] in members
+    return False
+
+async def check_invite(client: TelegramClient, user_id: int, invite_hash: str) -> Optional[bool]:
+    """Cached CheckChatInviteRequest: True if already a member, False if joinable, None if invalid.
+    Other errors (network, timeouts, flood waits) propagate and are not cached."""
+    from telethon.errors import InviteHashExpiredError, InviteHashInvalidError
+    from telethon.tl.functions.messages import CheckChatInviteRequest
+    from telethon.tl.types import ChatInviteAlready
+
+    key = (user_id, invite_hash)
+    cached = INVITE_CACHE.get(key)
+    if cached and time.time() - cached[0] < INVITE_CACHE_TTL:
+        return cached[1]
+    try:
+        res = await client(CheckChatInviteRequest(invite_hash))
+        state: Optional[bool] = isinstance(res, ChatInviteAlready)
+    except (InviteHashExpiredError, InviteHashInvalidError):
+        state = None  # expired or invalid link
+    INVITE_CACHE[key] = (time.time(), state)
+    while len(INVITE_CACHE) > INVITE_CACHE_SIZE:
+        INVITE_CACHE.pop(next(iter(INVITE_CACHE)))
+    return state
+
+# ---------- Background jobs ----------
+def create_job(user_id: int, kind: str, fields: Dict[str, Any]) -> Any:
+    """Persist a running job; its checkpoint lives in ``fields`` and is resumed after a restart.
+    Returns None when it could not be stored."""
+    now = time.time()
+    try:
+        return jobs_collection.insert_one({
+            "user_id": user_id,
+            "kind": kind,
+            "status": "running",
+            **fields,
+            "created_at": now,
+            "updated_at": now,
+        }).inserted_id
+    except Exception as e:
+        print(f"⚠️ MongoDB job create error for user {user_id}: {e}")
+        return None
+
+def record_job_items(job_id: Any, indexes: List[int], status: str):
+    """Mark items ``ok``, ``failed`` or ``skipped`` and bump the matching counter (one write)"""
+    if not indexes:
+        return
+    try:
+        jobs_collection.update_one({"_id": job_id}, {
+            "$set": {**{f"items.{i}.s": status for i in indexes}, "updated_at": time.time()},
+            "$inc": {status: len(indexes)},
+        })
+    except Exception as e:
+        print(f"⚠️ MongoDB job update error for {job_id}: {e}")
+
+def set_job_status(job_id: Any, status: str = "done"):
+    try:
+        jobs_collection.update_one({"_id": job_id}, {"$set": {"status": status, "updated_at": time.time()}})
+    except Exception as e:
+        print(f"⚠️ MongoDB job update error for {job_id}: {e}")
+
+def schedule_job(user_id: int, kind: str, job_id: Any, bot) -> asyncio.Task:
+    key = (user_id, kind)
+    task = asyncio.create_task(JOB_RUNNERS[kind](user_id, job_id, bot))
+    JOB_TASKS[key] = task
+    task.add_done_callback(lambda t: JOB_TASKS.pop(key, None) if JOB_TASKS.get(key) is t else None)
+    return task
+
+def job_running(user_id: int, kind: str) -> bool:
+    t = JOB_TASKS.get((user_id, kind))
+    return t is not None and not t.done()
+
+async def run_auto_join(user_id: int, job_id: Any, bot):
+    """Join the job's pending targets with AUTO_JOIN_CONCURRENCY workers on the shared client.
+
+    A FloodWait pauses every worker for the real ``fw.seconds`` and the target is retried.
+    Each result is written to the job, so a restart continues with what is still pending."""
+    from telethon.errors import UserAlreadyParticipantError
+    from telethon.tl.functions.channels import JoinChannelRequest
+    from telethon.tl.functions.messages import ImportChatInviteRequest
+
+    job = jobs_collection.find_one({"_id": job_id})
+    if not job:
+        return
+    items = job["items"]
+    total = len(items)
+    counts = {status: job.get(status, 0) for status in ("ok", "failed", "skipped")}
+
+    # Targets the account is already in never reach the network
+    members = known_memberships(user_id)
+    queue: asyncio.Queue = asyncio.Queue()
+    skipped: List[int] = []
+    for i, item in enumerate(items):
+        if item["s"] != "pending":
+            continue
+        if already_member(members, parse_join_target(item["t"])):
+            item["s"] = "skipped"
+            skipped.append(i)
+        else:
+            queue.put_nowait(i)
+    counts["skipped"] += len(skipped)
+    record_job_items(job_id, skipped, "skipped")
+
+    client = await acquire_client(user_id)
+    if client is None:
+        set_job_status(job_id, "failed")
+        await edit_banner_progress(user_id, bot, "📥 Auto Join stopped: please login first.", kb_back_to_toolkit())
+        return
+
+    resume_at = [0.0]  # shared flood gate
+    last_edit = [0.0]
+
+    async def progress(force: bool = False):
+        now = time.monotonic()
+        if not force and now - last_edit[0] < JOB_PROGRESS_INTERVAL:
+            return
+        last_edit[0] = now
+        done = sum(counts.values())
+        wait = resume_at[0] - now
+        caption = (
+            f"📥 Auto Join in progress…\n"
+            f"📊 {done}/{total}   ✅ {counts['ok']}   ⏭ {counts['skipped']}   ❌ {counts['failed']}"
+            + (f"\n⏳ Flood wait: {int(wait)}s" if wait > 0 else "")
+        )
+        await edit_banner_progress(user_id, bot, caption, kb_back_to_toolkit())
+
+    async def join(t: Dict[str, Any]) -> str:
+        if t["type"] == "invite":
+            state = await check_invite(client, user_id, t["hash"])
+            if state is None:
+                return "failed"
+            if state:
+                return "skipped"
+            await client(ImportChatInviteRequest(t["hash"]))
+            INVITE_CACHE[(user_id, t["hash"])] = (time.time(), True)
+        elif t["type"] == "username":
+            await client(JoinChannelRequest(t["value"]))
+            members.add(t["value"].lower())
+        else:  # id
+            await client(JoinChannelRequest(await client.get_entity(t["value"])))
+            members.add(t["value"])
+        return "ok"
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            t = parse_join_target(items[i]["t"])
+            while True:
+                wait = resume_at[0] - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    status = await join(t)
+                except UserAlreadyParticipantError:
+                    status = "skipped"
+                except FloodWaitError as fw:
+                    resume_at[0] = max(resume_at[0], time.monotonic() + fw.seconds + 1)
+                    await progress(force=True)
+                    continue
+                except Exception:
+                    status = "failed"
+                break
+            items[i]["s"] = status
+            counts[status] += 1
+            record_job_items(job_id, [i], status)
+            await progress()
+            await asyncio.sleep(AUTO_JOIN_GAP)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(AUTO_JOIN_CONCURRENCY, queue.qsize()))))
+    finally:
+        await release_client(user_id, client)
+
+    set_job_status(job_id)
+    joined = [join_label(it["t"], parse_join_target(it["t"])) for it in items if it["s"] == "ok"]
+    joined_preview = ", ".join(joined[:5]) + (" …" if len(joined) > 5 else "")
+    res = (
+        f"📥 Auto Join complete\n"
+        f"✅ {counts['ok']}   ⏭ {counts['skipped']} already in   ❌ {counts['failed']}\n"
+        f"{('✅ Joined ' + joined_preview) if joined else ''}"
+    ).strip()
+    await edit_banner_progress(user_id, bot, res, kb_back_to_toolkit())
+
+# ---------- Mass Broadcast ----------
+class SendPacer:
+    """Shared pacing for concurrent senders: at most ``rate`` sends per second,
+    and a FloodWait pauses every sender for the real wait."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self.resume_at = 0.0
+
+    async def wait(self):
+        while True:
+            now = time.monotonic()
+            slot = max(self.next_at, self.resume_at)
+            if slot <= now:
+                self.next_at = now + self.interval
+                return
+            await asyncio.sleep(slot - now)
+
+    def flood(self, seconds: int):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds + 1)
+
+def is_private_recipient(ent) -> bool:
+    from telethon.tl.types import User as TLUser
+    return isinstance(ent, TLUser) and not ent.bot and not ent.is_self and not ent.deleted
+
+def save_recipients(user_id: int, peers: List[List[int]], synced_at: float, full: bool):
+    fields: Dict[str, Any] = {"peers": peers, "synced_at": synced_at}
+    if full:
+        fields["full_at"] = synced_at
+    try:
+        recipients_collection.update_one({"user_id": user_id}, {"$set": fields}, upsert=True)
+    except Exception as e:
+        print(f"⚠️ MongoDB recipients write error for user {user_id}: {e}")
+
+async def sync_recipients(user_id: int, client: TelegramClient, allow_full: bool = True) -> List[List[int]]:
+    """Refresh the cached recipients and return them. A full rescan (which also drops chats
+    that are gone) runs when none exists yet or, with ``allow_full``, every RECIPIENT_FULL_REFRESH;
+    otherwise only dialogs active since the last sync are read (newest first)."""
+    doc = recipients_collection.find_one({"user_id": user_id}, {"_id": 0})
+    started = time.time()
+    has_full = bool(doc and doc.get("full_at"))
+    full = not has_full or (allow_full and started - doc["full_at"] > RECIPIENT_FULL_REFRESH)
+    peers: Dict[int, int] = {} if full else {pid: h for pid, h in doc.get("peers", [])}
+    since = 0 if full else doc.get("synced_at", 0) - 60
+
+    async for dlg in client.iter_dialogs():
+        if since and not dlg.pinned and dlg.date and dlg.date.timestamp() < since:
+            break
+        if is_private_recipient(dlg.entity):
+            peers[dlg.entity.id] = dlg.entity.access_hash
+        else:
+            peers.pop(dlg.id, None)  # e.g. the account was deleted since the last sync
+
+    result = [[pid, h] for pid, h in peers.items()]
+    save_recipients(user_id, result, started, full)
+    return result
+
+async def _refresh_recipients(user_id: int):
+    client = await acquire_client(user_id)
+    if client is None:
+        return
+    try:
+        await sync_recipients(user_id, client)
+    except Exception as e:
+        print(f"⚠️ Recipient refresh failed for user {user_id}: {e}")
+    finally:
+        await release_client(user_id, client)
+
+def schedule_recipient_refresh(user_id: int) -> asyncio.Task:
+    """Refresh cached recipients in the background (at most one refresh per user)"""
+    t = RECIPIENT_SYNC_TASKS.get(user_id)
+    if t and not t.done():
+        return t
+    t = asyncio.create_task(_refresh_recipients(user_id))
+    RECIPIENT_SYNC_TASKS[user_id] = t
+    return t
+
+async def broadcast_recipients(user_id: int, client: TelegramClient):
+    """(peer_id, peer) pairs for a broadcast. Once a full scan exists (``full_at``, even when it
+    found nobody), the cache is first brought up to date with an incremental pass, so chats started
+    since the last sync are included; a due full rescan then runs in the background. Without one,
+    a full dialog scan streams recipients directly and fills the cache."""
+    from telethon.tl.types import InputPeerUser
+
+    doc = recipients_collection.find_one({"user_id": user_id}, {"_id": 0, "full_at": 1})
+    if doc and doc.get("full_at"):
+        peers = await sync_recipients(user_id, client, allow_full=False)
+        if time.time() - doc["full_at"] > RECIPIENT_FULL_REFRESH:
+            schedule_recipient_refresh(user_id)
+        for pid, access_hash in peers:
+            yield pid, InputPeerUser(pid, access_hash)
+        return
+
+    started = time.time()
+    peers: List[List[int]] = []
+    async for dlg in client.iter_dialogs():
+        ent = dlg.entity
+        if is_private_recipient(ent):
+            peers.append([ent.id, ent.access_hash])
+            yield ent.id, ent
+    save_recipients(user_id, peers, started, full=True)
+
+async def broadcast_to_private_chats(client: TelegramClient, recipients, out_text: str, media_path: Optional[str], skip: set, on_result) -> int:
+    """Send one message to every ``(peer_id, peer)`` from ``recipients`` not in ``skip``
+    through BROADCAST_CONCURRENCY paced senders; ``on_result(peer_id, ok)`` is awaited
+    per recipient. Returns how many recipients were streamed.
+
+    Media is uploaded with the first successful send; every later send reuses
+    that message's media by reference instead of uploading the file again."""
+    streamed = [0]
+    pacer = SendPacer(BROADCAST_RATE)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 4)
+    caption = out_text or None
+    media_ref: List[Any] = [None]
+    upload_lock = asyncio.Lock()
+
+    async def send(ent):
+        if not media_path:
+            await client.send_message(ent, out_text)
+            return
+        if media_ref[0] is None:
+            async with upload_lock:
+                if media_ref[0] is None:
+                    msg = await client.send_file(ent, file=media_path, caption=caption)
+                    media_ref[0] = msg.media
+                    return
+        await client.send_file(ent, file=media_ref[0], caption=caption)
+
+    async def produce():
+        try:
+            async for peer_id, peer in recipients:
+                streamed[0] += 1
+                if peer_id not in skip:
+                    await queue.put((peer_id, peer))
+        finally:
+            for _ in range(BROADCAST_CONCURRENCY):
+                await queue.put(None)
+
+    async def sender():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            peer_id, peer = item
+            while True:
+                await pacer.wait()
+                try:
+                    await send(peer)
+                    ok = True
+                except FloodWaitError as fw:
+                    pacer.flood(fw.seconds)
+                    continue
+                except Exception:
+                    ok = False
+                break
+            await on_result(peer_id, ok)
+
+    await asyncio.gather(produce(), *(sender() for _ in range(BROADCAST_CONCURRENCY)))
+    return streamed[0]
+
+def kb_broadcast_running(job_id: Any) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⏹ Cancel broadcast", callback_data=f"bc:cancel:{job_id}")]])
+
+def kb_broadcast_cancelled(job_id: Any) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("▶️ Resume broadcast", callback_data=f"bc:resume:{job_id}")],
+        [InlineKeyboardButton("🔙 Back", callback_data="mf:open")]
+    ])
+
+async def download_bot_file(bot, file_id: str, suffix: str, prefix: str) -> str:
+    fobj = await bot.get_file(file_id)
+    # Use temp directory for downloaded files
+    temp_dir = Path("./temp")
+    temp_dir.mkdir(exist_ok=True)
+    local = temp_dir / f"{prefix}_{secrets.token_hex(4)}{suffix}"
+    await fobj.download_to_drive(custom_path=str(local))
+    return str(local)
+
+async def run_broadcast(user_id: int, job_id: Any, bot):
+    """Background Mass Broadcast. Processed peer ids are checkpointed on the job in batches,
+    so a cancelled or interrupted broadcast resumes where it stopped."""
+    job = jobs_collection.find_one({"_id": job_id})
+    if not job:
+        return
+    counts = {"sent": job.get("sent", 0), "failed": job.get("failed", 0)}
+    pending: List[int] = []
+    pending_counts = {"sent": 0, "failed": 0}
+    last_flush = [time.monotonic()]
+    last_edit = [0.0]
+
+    def flush():
+        if not pending:
+            return
+        try:
+            jobs_collection.update_one({"_id": job_id}, {
+                "$push": {"done": {"$each": list(pending)}},
+                "$inc": dict(pending_counts),
+                "$set": {"updated_at": time.time()},
+            })
+        except Exception as e:
+            print(f"⚠️ MongoDB job update error for {job_id}: {e}")
+        pending.clear()
+        pending_counts.update(sent=0, failed=0)
+        last_flush[0] = time.monotonic()
+
+    async def on_result(peer_id: int, ok: bool):
+        key = "sent" if ok else "failed"
+        counts[key] += 1
+        pending.append(peer_id)
+        pending_counts[key] += 1
+        if len(pending) >= 50 or time.monotonic() - last_flush[0] > JOB_PROGRESS_INTERVAL:
+            flush()
+        if time.monotonic() - last_edit[0] >= JOB_PROGRESS_INTERVAL:
+            last_edit[0] = time.monotonic()
+            await edit_banner_progress(
+                user_id, bot,
+                f"📢 Mass Broadcast running…\n✅ Sent: {counts['sent']}   ❌ Failed: {counts['failed']}",
+                kb_broadcast_running(job_id)
+            )
+
+    client = await acquire_client(user_id)
+    if client is None:
+        set_job_status(job_id, "failed")
+        await edit_banner_progress(user_id, bot, "📢 Broadcast stopped: please login first.", kb_back_to_toolkit())
+        return
+
+    await send_log_to_user(
+        user_id,
+        (f"📢 Mass Broadcast Resumed\n\n" if job.get("done") else f"📢 Mass Broadcast Started\n\n")
+        + f"📨 Sending to all private chats...\n"
+        f"⏳ Please wait..."
+    )
+
+    media_path = None
+    try:
+        media = job.get("media")
+        if media:
+            media_path = await download_bot_file(bot, media["file_id"], media["suffix"], f"bc_{user_id}")
+        total = await broadcast_to_private_chats(
+            client, broadcast_recipients(user_id, client),
+            job.get("text", ""), media_path, set(job.get("done", [])), on_result
+        )
+    except asyncio.CancelledError:
+        flush()
+        raise
+    except Exception as e:
+        flush()
+        set_job_status(job_id, "cancelled")
+        print(f"⚠️ Broadcast {job_id} failed for {user_id}: {e}")
+        await edit_banner_progress(user_id, bot, f"⚠️ Broadcast interrupted: {e}", kb_broadcast_cancelled(job_id))
+        return
+    finally:
+        await release_client(user_id, client)
+        try:
+            if media_path:
+                Path(media_path).unlink(missing_ok=True)
+        except Exception:
+            pass
+    flush()
+    set_job_status(job_id)
+
+    sent, failed = counts["sent"], counts["failed"]
+    # Send final log
+    await send_log_to_user(
+        user_id,
+        f"✅ Mass Broadcast Complete\n\n"
+        f"📊 Total chats processed: {total}\n"
+        f"✅ Successfully sent: {sent}\n"
+        f"❌ Failed: {failed}\n"
+        f"📈 Success rate: {(sent/(sent+failed)*100) if sent + failed > 0 else 0:.1f}%"
+    )
+    await edit_banner_progress(user_id, bot, f"✅ Broadcast sent to {sent} chats.", kb_back_to_toolkit())
+
+JOB_RUNNERS = {"auto_join": run_auto_join, "broadcast": run_broadcast}
+
+async def resume_jobs(app: Application):
+    """On startup: pick up background jobs that were interrupted mid-run"""
+    try:
+        jobs = list(jobs_collection.find({"kind": {"$in": list(JOB_RUNNERS)}, "status": "running"}, {"user_id": 1, "kind": 1}))
+    except Exception as e:
+        print(f"⚠️ MongoDB job lookup error: {e}")
+        return
+    for job in jobs:
+        if not job_running(job["user_id"], job["kind"]):
+            schedule_job(job["user_id"], job["kind"], job["_id"], app.bot)
+    if jobs:
+        print(f"✅ Resumed {len(jobs)} background job(s)")
+
 def _normalize_keyboard(kb_like: Any) -> Optional[InlineKeyboardMarkup]:
     if isinstance(kb_like, InlineKeyboardMarkup):
         return kb_like
@@ -1101,6 +2322,9 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     first = update.effective_user.first_name or "there"
     u = load_user(user_id, force=True)
     chat_id = update.effective_chat.id
+    if u.pop("bot_blocked", None):
+        u.pop("bot_blocked_at", None)
+        clear_bot_blocked(user_id)
 
     # Always send new message for /start command
     if not allowed_to_use(user_id, u):
@@ -1170,10 +2394,13 @@ async def try_sign_in_with_code(user_id: int, context: ContextTypes.DEFAULT_TYPE
         await client.sign_in(phone, code)
         await client.disconnect()
         LOGIN_CLIENTS.pop(user_id, None)
+        await stop_reply_listener(user_id)
+        await drop_client(user_id)
         finalize_tmp_to_final(user_id)
         u["step"] = STEP_NONE
         u["login"]["otp"] = ""
         save_user(user_id)
+        await ensure_reply_listener(user_id)
         
         # Upload session to MongoDB
         session_path = u.get("session_base")
@@ -1222,7 +2449,11 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = (q.data or "").strip()
     user_id = q.from_user.id
     first = q.from_user.first_name or "there"
-    u = load_user(user_id, force=True)
+    is_toggle = data.startswith("toggle_group:")
+    if not is_toggle:
+        flush_pending_toggles(user_id)
+    # A toggle only touches the in-memory picker: serve it from the cached user, no read per tap
+    u = load_user(user_id, force=not is_toggle)
 
     # "More features": integrated directly
     if data == "more_features" or data == "mf:open":
@@ -1245,7 +2476,9 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Works in DM & safe in groups.\n\n"
             "Paste multiple lines like:\n"
             "Main word -> Your reply\n"
-            "another_word -> Another reply"
+            "another_word -> Another reply\n\n"
+            "Options: =word matches whole words only, !2 sets priority (higher wins).\n\n"
+            f"{reply_listener_status(user_id)}"
         )
         await q.answer()
         return await edit_caption_keep_banner(user_id, context, msg, kb_auto_reply())
@@ -1263,7 +2496,8 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text=(
                 "Send your pairs now (one per line):\n"
                 "hello -> Hi there!\n"
-                "price -> Our plans start at $9.99"
+                "price -> Our plans start at $9.99\n"
+                "=hi !5 -> Whole word \"hi\" only, checked first"
             ),
             parse_mode="HTML",
             reply_markup=kb_back_to_toolkit()
@@ -1276,8 +2510,11 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f = _ensure_features_dict(u)
         f["auto_reply"]["enabled"] = True
         save_user(user_id)
+        if not await ensure_reply_listener(user_id):
+            await q.answer("Enabled — login to start listening on your account.", show_alert=True)
+            return await edit_caption_keep_banner(user_id, context, "✅ Auto Reply enabled.\n⚠️ Not listening yet: login required.", kb_auto_reply())
         await q.answer("Enabled")
-        return await edit_caption_keep_banner(user_id, context, "✅ Auto Reply enabled.", kb_auto_reply())
+        return await edit_caption_keep_banner(user_id, context, "✅ Auto Reply enabled.\nListening to your DMs & groups.", kb_auto_reply())
 
     if data == "mf:ar_off":
         if not allowed_to_use(user_id, u):
@@ -1286,6 +2523,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f = _ensure_features_dict(u)
         f["auto_reply"]["enabled"] = False
         save_user(user_id)
+        await stop_reply_listener(user_id)
         await q.answer("Disabled")
         return await edit_caption_keep_banner(user_id, context, "⛔ Auto Reply disabled.", kb_auto_reply())
 
@@ -1298,7 +2536,10 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not pairs:
             txt = "No pairs saved yet."
         else:
-            blob = "\n".join([f"• {p['kw']} → {p['reply']}" for p in pairs[:50]])
+            blob = "\n".join([
+                f"• {'=' if p.get('word') else ''}{p['kw']}{' !' + str(p['priority']) if p.get('priority') else ''} → {p['reply']}"
+                for p in pairs[:50]
+            ])
             extra = f"\n… and {len(pairs)-50} more." if len(pairs) > 50 else ""
             txt = f"Saved pairs ({len(pairs)}):\n{blob}{extra}"
         await q.answer()
@@ -1310,6 +2551,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         f = _ensure_features_dict(u)
         f["auto_reply"]["pairs"] = []
+        f["auto_reply"]["rev"] = f["auto_reply"].get("rev", 0) + 1
         save_user(user_id)
         await q.answer("Cleared")
         return await edit_caption_keep_banner(user_id, context, "🧹 Cleared all pairs.", kb_auto_reply())
@@ -1353,6 +2595,45 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return await edit_caption_keep_banner(user_id, context, text, kb_back_to_toolkit())
 
+    if data.startswith("bc:cancel:") or data.startswith("bc:resume:"):
+        action, raw_id = data.split(":")[1:]
+        try:
+            job_id = ObjectId(raw_id)
+        except Exception:
+            await q.answer("Unknown broadcast.", show_alert=True)
+            return
+        job = jobs_collection.find_one({"_id": job_id, "user_id": user_id, "kind": "broadcast"}, {"status": 1, "sent": 1, "failed": 1})
+        if not job:
+            await q.answer("Unknown broadcast.", show_alert=True)
+            return
+
+        if action == "cancel":
+            if job["status"] != "running":
+                await q.answer("This broadcast is not running.")
+                return
+            set_job_status(job_id, "cancelled")
+            task = JOB_TASKS.get((user_id, "broadcast"))
+            if task and not task.done():
+                task.cancel()
+            await q.answer("Broadcast cancelled")
+            return await edit_caption_keep_banner(
+                user_id, context,
+                f"⏹ Broadcast cancelled.\n✅ Sent: {job.get('sent', 0)}   ❌ Failed: {job.get('failed', 0)}\nResume to continue with the remaining chats.",
+                kb_broadcast_cancelled(job_id)
+            )
+
+        if job["status"] != "cancelled" or job_running(user_id, "broadcast"):
+            await q.answer("Nothing to resume.")
+            return
+        if not allowed_to_use(user_id, u):
+            await q.answer("Premium required.", show_alert=True)
+            return
+        set_job_status(job_id, "running")
+        await q.answer("Resuming…")
+        await edit_caption_keep_banner(user_id, context, "📢 Mass Broadcast resumed…\nProgress updates here.", kb_broadcast_running(job_id))
+        schedule_job(user_id, "broadcast", job_id, context.bot)
+        return
+
     # --- Smart Rotation toggle ---
     if data == "mf:rotation":
         if not allowed_to_use(user_id, u):
@@ -1705,11 +2986,13 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         save_user(user_id)
         
         # Show group picker
-        ok = await collect_user_groups(user_id)
+        ok = await ensure_destinations(user_id, context.bot)
         if not ok:
             await q.answer("Failed to load groups!", show_alert=True)
             return
         
+        reset_group_picker(u)
+        save_user(user_id)
         await show_group_picker(user_id, context)
         return
 
@@ -1841,16 +3124,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Get targets based on mode
         if group_mode == "all_groups":
-            # Collect all groups
-            ok = await collect_user_groups(user_id)
+            # Cached groups (refreshed in the background / between rounds)
+            ok = await ensure_destinations(user_id, context.bot)
             if not ok:
                 await q.answer("Failed to load groups!", show_alert=True)
                 return
             
-            # Filter regular groups only
-            all_groups = u["group_picker"]["groups"]
-            regular_groups = [g for g in all_groups if g.get("group_type") == "group"]
-            targets = [{"display_id": g["display_id"]} for g in regular_groups]
+            # Regular groups only
+            targets = [{"display_id": gid} for gid in destination_ids(user_id, ["group"])]
         else:  # selected_groups
             targets = [{"display_id": gid} for gid in ps.get("selected_groups", [])]
         
@@ -1861,12 +3142,15 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Build ad_setup
         if forward_mode == "saved_message":
             # Use latest saved message from "me"
-            client = get_final_client(user_id)
+            client = await acquire_client(user_id)
             if not client:
                 await q.answer("Please login first!", show_alert=True)
                 return
             
-            msgs = await client.get_messages("me", limit=1)
+            try:
+                msgs = await client.get_messages("me", limit=1)
+            finally:
+                await release_client(user_id, client)
             if not msgs or not msgs[0]:
                 await q.answer("No saved messages found!", show_alert=True)
                 return
@@ -1883,6 +3167,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "post_link": None,
                 "fallback_message": ps.get("fallback_message"),
                 "targets": targets,
+                "target_mode": group_mode,
                 "round_delay": round_delay,
                 "send_gap_max": message_delay
             }
@@ -1898,6 +3183,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "post_link": ps.get("post_link"),
                 "fallback_message": ps.get("fallback_message"),
                 "targets": targets,
+                "target_mode": group_mode,
                 "round_delay": round_delay,
                 "send_gap_max": message_delay
             }
@@ -1929,53 +3215,27 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Select all groups (in current filtered view)
     if data == "select_all_groups":
-        gp = u["group_picker"]
-        search_filter = gp.get("search_filter", "").lower()
-        
-        # Filter out forum groups - only select regular groups and topics
-        non_forum_groups = [g for g in gp["groups"] if g.get("group_type") != "forum"]
+        state = picker_state(user_id)
+        search_filter = u["group_picker"].get("search_filter", "").lower()
         
-        # Get filtered groups
-        if search_filter:
-            filtered_groups = [g for g in non_forum_groups if search_filter in g["title"].lower()]
-        else:
-            filtered_groups = non_forum_groups
-        
-        # Add all filtered groups to selection
-        count = 0
-        for group in filtered_groups:
-            disp_id = group["display_id"]
-            if disp_id not in gp["selected_ids"]:
-                gp["selected_ids"].append(disp_id)
-                count += 1
+        # Union with the current filtered view
+        count = len(state.add_many(state.view_set(search_filter)))
+        save_picker_selection(user_id, state)
         
         await q.answer(f"Selected {count} groups/topics", show_alert=False)
-        save_user(user_id)
         await show_group_picker(user_id, context)
         return
     
     # Unselect all groups (in current filtered view)
     if data == "unselect_all_groups":
-        gp = u["group_picker"]
-        search_filter = gp.get("search_filter", "").lower()
+        state = picker_state(user_id)
+        search_filter = u["group_picker"].get("search_filter", "").lower()
         
-        # Filter out forum groups - only unselect regular groups and topics
-        non_forum_groups = [g for g in gp["groups"] if g.get("group_type") != "forum"]
-        
-        # Get filtered groups
-        if search_filter:
-            filtered_groups = [g for g in non_forum_groups if search_filter in g["title"].lower()]
-        else:
-            filtered_groups = non_forum_groups
-        
-        # Remove all filtered groups from selection
-        filtered_ids = [g["display_id"] for g in filtered_groups]
-        original_count = len(gp["selected_ids"])
-        gp["selected_ids"] = [sid for sid in gp["selected_ids"] if sid not in filtered_ids]
-        removed_count = original_count - len(gp["selected_ids"])
+        # Difference with the current filtered view
+        removed_count = len(state.remove_many(state.view_set(search_filter)))
+        save_picker_selection(user_id, state)
         
         await q.answer(f"Unselected {removed_count} groups/topics", show_alert=False)
-        save_user(user_id)
         await show_group_picker(user_id, context)
         return
     
@@ -1986,190 +3246,46 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Add groups only (merged regular + supergroups, no forums, no topics)
     if data == "add_groups_only":
-        gp = u["group_picker"]
+        state = picker_state(user_id)
         # Add from ALL groups, not just filtered
-        all_groups = gp["groups"]
-        
-        # Get groups to add
-        groups_to_add = [g for g in all_groups 
-                         if g.get("group_type") == "group" 
-                         and g["display_id"] not in gp["selected_ids"]]
-        
-        total_to_add = len(groups_to_add)
-        
-        if total_to_add == 0:
+        added = state.add_many(state.type_set("group"))
+        if not added:
             await q.answer("All groups already selected!", show_alert=False)
             return
         
-        # Show live progress
-        chat_id, msg_id, _ = get_last_msg(u)
-        count = 0
-        
-        for i, group in enumerate(groups_to_add, 1):
-            group_id = group["display_id"]
-            gp["selected_ids"].append(group_id)
-            count += 1
-            
-            # Update every 10 groups or at the end
-            if i % 10 == 0 or i == total_to_add:
-                try:
-                    await context.bot.edit_message_caption(
-                        chat_id=chat_id,
-                        message_id=msg_id,
-                        caption=f"⏳ <b>Adding Groups...</b>\n\n📊 Progress: {i}/{total_to_add}\n💬 Added: {count} groups",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
-        
-        save_user(user_id)
-        
-        # Show success message
-        try:
-            await context.bot.edit_message_caption(
-                chat_id=chat_id,
-                message_id=msg_id,
-                caption=f"✅ <b>All Groups Added!</b>\n\n📊 Total: {count} groups added successfully!",
-                parse_mode="HTML"
-            )
-        except:
-            pass
-        
-        await asyncio.sleep(1.5)
-        
-        # Refresh the keyboard
-        kb = group_picker_kb(user_id)
+        save_picker_selection(user_id, state)
+        await q.answer(f"✅ Added {len(added)} groups!")
         await show_group_picker(user_id, context)
-        
-        await q.answer(f"✅ Added {count} groups!")
         return
     
     # Add topics only (topics from forums)
     if data == "add_forums_only":
-        gp = u["group_picker"]
+        state = picker_state(user_id)
         # Add from ALL groups, not just filtered - select only topics
-        all_groups = gp["groups"]
-        
-        # Get topics to add
-        topics_to_add = [g for g in all_groups 
-                         if g.get("group_type") == "topic" 
-                         and g["display_id"] not in gp["selected_ids"]]
-        
-        total_to_add = len(topics_to_add)
-        
-        if total_to_add == 0:
+        added = state.add_many(state.type_set("topic"))
+        if not added:
             await q.answer("All topics already selected!", show_alert=False)
             return
         
-        # Show live progress
-        chat_id, msg_id, _ = get_last_msg(u)
-        count = 0
-        
-        for i, group in enumerate(topics_to_add, 1):
-            group_id = group["display_id"]
-            gp["selected_ids"].append(group_id)
-            count += 1
-            
-            # Update every 10 topics or at the end
-            if i % 10 == 0 or i == total_to_add:
-                try:
-                    await context.bot.edit_message_caption(
-                        chat_id=chat_id,
-                        message_id=msg_id,
-                        caption=f"⏳ <b>Adding Topics...</b>\n\n📊 Progress: {i}/{total_to_add}\n📑 Added: {count} topics",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
-        
-        save_user(user_id)
-        
-        # Show success message
-        try:
-            await context.bot.edit_message_caption(
-                chat_id=chat_id,
-                message_id=msg_id,
-                caption=f"✅ <b>All Topics Added!</b>\n\n📊 Total: {count} topics added successfully!",
-                parse_mode="HTML"
-            )
-        except:
-            pass
-        
-        await asyncio.sleep(1.5)
-        
-        # Refresh the keyboard
-        kb = group_picker_kb(user_id)
+        save_picker_selection(user_id, state)
+        await q.answer(f"✅ Added {len(added)} topics!")
         await show_group_picker(user_id, context)
-        
-        await q.answer(f"✅ Added {count} topics!")
         return
     
     # Add all groups and topics (exclude forum groups)
     if data == "add_all_groups":
-        gp = u["group_picker"]
-        # Add from ALL groups, not just filtered
-        all_groups = gp["groups"]
-        
-        # Get all items to add (groups + topics, exclude forums)
-        items_to_add = [g for g in all_groups 
-                        if g.get("group_type") != "forum" 
-                        and g["display_id"] not in gp["selected_ids"]]
-        
-        total_to_add = len(items_to_add)
-        
-        if total_to_add == 0:
+        state = picker_state(user_id)
+        # Add from ALL groups, not just filtered (groups + topics, never forums)
+        added = state.add_many(state.view_set(""))
+        if not added:
             await q.answer("All items already selected!", show_alert=False)
             return
         
-        # Show live progress
-        chat_id, msg_id, _ = get_last_msg(u)
-        count = 0
-        groups_added = 0
-        topics_added = 0
-        
-        for i, group in enumerate(items_to_add, 1):
-            group_id = group["display_id"]
-            group_type = group.get("group_type", "")
-            gp["selected_ids"].append(group_id)
-            count += 1
-            
-            if group_type == "group":
-                groups_added += 1
-            elif group_type == "topic":
-                topics_added += 1
-            
-            # Update every 10 items or at the end
-            if i % 10 == 0 or i == total_to_add:
-                try:
-                    await context.bot.edit_message_caption(
-                        chat_id=chat_id,
-                        message_id=msg_id,
-                        caption=f"⏳ <b>Adding All...</b>\n\n📊 Progress: {i}/{total_to_add}\n💬 Groups: {groups_added}\n📑 Topics: {topics_added}",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
-        
-        save_user(user_id)
-        
-        # Show success message
-        try:
-            await context.bot.edit_message_caption(
-                chat_id=chat_id,
-                message_id=msg_id,
-                caption=f"✅ <b>All Items Added!</b>\n\n📊 Total: {count} destinations\n💬 Groups: {groups_added}\n📑 Topics: {topics_added}",
-                parse_mode="HTML"
-            )
-        except:
-            pass
-        
-        await asyncio.sleep(1.5)
-        
-        # Refresh the keyboard
-        kb = group_picker_kb(user_id)
+        groups_added = len(added & state.type_set("group"))
+        topics_added = len(added & state.type_set("topic"))
+        save_picker_selection(user_id, state)
+        await q.answer(f"✅ Added {len(added)} items! ({groups_added} groups, {topics_added} topics)")
         await show_group_picker(user_id, context)
-        
-        await q.answer(f"✅ Added {count} items!")
         return
     
     # Back to group selection
@@ -2242,7 +3358,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = get_last_msg(u)[0] or user_id
         await context.bot.send_message(
             chat_id=chat_id,
-            text="🔍 Search Groups/Topics\n\nSend a keyword to filter groups and topics.\n\nExample: instagram",
+            text="🔍 Search Groups/Topics\n\nSend a keyword to filter groups and topics.\nBest matches are shown first; close titles are suggested when nothing matches.\n\nExample: instagram",
             parse_mode="HTML"
         )
         return
@@ -2270,23 +3386,16 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except ValueError:
             pass
         
-        sel = u["group_picker"]["selected_ids"]
-        if disp_id in sel:
-            sel.remove(disp_id)
-            action = "Deselected"
-        else:
-            sel.append(disp_id)
-            action = "Selected"
+        state = picker_state(user_id)
+        action = "Selected" if state.toggle(disp_id) else "Deselected"
         
-        save_user(user_id)
-        
-        # Answer callback BEFORE the heavy operation
+        # Applied in memory; the write and the message edit are coalesced per burst
         try:
             await q.answer(action, show_alert=False)
         except Exception:
             pass  # Ignore if already answered or expired
         
-        await show_group_picker(user_id, context)
+        schedule_picker_flush(user_id, context)
         return
 
     # Continue → confirm selected groups
@@ -2351,67 +3460,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Check if there are any unselected regular groups
-        gp = u["group_picker"]
-        search_filter = gp.get("search_filter", "").lower()
-        
-        # Get filtered groups
-        if search_filter:
-            filtered_groups = [g for g in gp["groups"] if search_filter in g["title"].lower()]
-        else:
-            filtered_groups = gp["groups"]
-        
         # Show selection actions menu instead of auto-adding
         await q.answer()
         
-        # Count available groups by type (excluding already selected and topics)
-        # IMPORTANT: Count from ALL groups, not just filtered ones!
-        groups_count = 0  # Merged regular + supergroups
-        forum_count = 0
-        
-        # Use ALL groups for counting available, not just filtered
-        all_groups = gp["groups"]
-        
-        print(f"\n{'='*60}")
-        print(f"DEBUG: Counting groups by type...")
-        print(f"Total ALL groups: {len(all_groups)}")
-        print(f"Total filtered groups (by search): {len(filtered_groups)}")
-        print(f"Already selected: {len(sel)}")
-        print(f"{'='*60}")
-        
-        for idx, group in enumerate(all_groups, 1):
-            group_id = group.get("display_id")
-            group_type = group.get("group_type", "unknown")
-            group_title = group.get("title", "Unknown")[:40]
-            
-            print(f"[{idx}/{len(filtered_groups)}] {group_title}")
-            print(f"  Type: {group_type}, ID: {group_id}")
-            
-            # Skip already selected
-            if group_id in sel:
-                print(f"  → Skipped (already selected)")
-                continue
-            
-            # Count by type (skip forums, count groups and topics)
-            if group_type == "topic":
-                forum_count += 1  # Actually counting topics here
-                print(f"  ▸ ✅ TOPIC (count: {forum_count})")
-            elif group_type == "group":  # Merged type
-                groups_count += 1
-                print(f"  ▸ ✅ GROUP (count: {groups_count})")
-            elif group_type == "forum":
-                # Skip forum groups completely
-                print(f"  ▸ Skipped (is forum group)")
-                continue
-            else:
-                print(f"  ▸ ⚠️ UNKNOWN TYPE: {group_type}")
-        
-        print(f"\n{'='*60}")
-        print(f"FINAL COUNTS:")
-        print(f"  💬 Groups: {groups_count}")
-        print(f"  📑 Topics: {forum_count}")
-        print(f"{'='*60}\n")
-        
+        # Count available groups by type (excluding already selected), from ALL groups not just filtered
+        not_selected = {"display_id": {"$nin": list(sel)}}
+        groups_count = count_destinations(user_id, ["group"], extra=not_selected)  # Merged regular + supergroups
+        forum_count = count_destinations(user_id, ["topic"], extra=not_selected)  # Actually counting topics here
+
         # Build selection menu
         selection_text = (
             f"✅ Selection Confirmed!\n\n"
@@ -2461,6 +3517,8 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "logout":
         await q.answer()
         await stop_ads_loop(user_id, context)
+        await stop_reply_listener(user_id)
+        await drop_client(user_id)
 
         try:
             sfile(load_user(user_id)["session_base"]).unlink(missing_ok=True)
@@ -2513,6 +3571,7 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     first = update.effective_user.first_name or "there"
+    flush_pending_toggles(user_id)
     u = load_user(user_id, force=True)
     txt = update.message.text  # Define txt early for all handlers
 
@@ -2524,7 +3583,9 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parsed = parse_pairs(blob)
         f = _ensure_features_dict(u)
         for (k, v) in parsed:
-            f["auto_reply"]["pairs"].append({"kw": k, "reply": v})
+            f["auto_reply"]["pairs"].append(build_pair(k, v))
+        if parsed:
+            f["auto_reply"]["rev"] = f["auto_reply"].get("rev", 0) + 1
         u["step"] = None
         save_user(user_id)
         added = len(parsed)
@@ -2539,56 +3600,26 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not items:
             return await context.bot.send_message(chat_id=chat_id, text="Please send at least one target.", reply_markup=kb_back_to_toolkit())
 
-        client = get_final_client(user_id)
-        if client is None or not sfile(load_user(user_id)["session_base"]).exists():
+        if not has_session(user_id):
             return await context.bot.send_message(chat_id=chat_id, text="Please login first from the main flow.", reply_markup=kb_back_to_toolkit())
-
-        joined, failed = [], []
-
-        from telethon.errors import FloodWaitError as TelethonFloodWait, UserAlreadyParticipantError
-        from telethon.tl.functions.channels import JoinChannelRequest
-        from telethon.tl.functions.messages import ImportChatInviteRequest
-
-        await client.connect()
-        try:
-            for token in items:
-                t = parse_join_target(token)
-                ok = False
-                try:
-                    if t["type"] == "invite":
-                        await client(ImportChatInviteRequest(t["hash"]))
-                        ok = True
-                    elif t["type"] == "username":
-                        await client(JoinChannelRequest(t["value"]))
-                        ok = True
-                    else:  # id
-                        ent = await client.get_entity(t["value"])
-                        await client(JoinChannelRequest(ent))
-                        ok = True
-                except UserAlreadyParticipantError:
-                    ok = True
-                except TelethonFloodWait as fw:
-                    await asyncio.sleep(min(fw.seconds, 5))
-                except Exception:
-                    ok = False
-
-                if ok:
-                    label = token if token.startswith("@") else (f"@{t['value']}" if t["type"] == "username" else str(token))
-                    joined.append(label)
-                else:
-                    failed.append(token)
-                await asyncio.sleep(0.2)
-        finally:
-            await client.disconnect()
-
-        ok_n, fail_n = len(joined), len(failed)
-        joined_preview = ", ".join(joined[:5]) + (" …" if len(joined) > 5 else "")
-        res = (
-            f"📥 Auto Join complete\n"
-            f"✅ {ok_n}   ❌ {fail_n}\n"
-            f"{('✅ Joined ' + joined_preview) if ok_n else ''}"
-        ).strip()
-        await send_new_banner_text(user_id, context, res, kb_back_to_toolkit())
+        if job_running(user_id, "auto_join"):
+            return await context.bot.send_message(chat_id=chat_id, text="📥 An auto join is already running. Wait for it to finish.", reply_markup=kb_back_to_toolkit())
+
+        # Drop duplicate targets (same chat written differently), keep the first
+        unique: Dict[Tuple[str, Any], str] = {}
+        for token in items:
+            unique.setdefault(join_key(parse_join_target(token)), token)
+        items = list(unique.values())
+        job_id = create_job(user_id, "auto_join", {
+            "items": [{"t": t, "s": "pending"} for t in items],
+            "ok": 0,
+            "failed": 0,
+            "skipped": 0,
+        })
+        if job_id is None:
+            return await context.bot.send_message(chat_id=chat_id, text="⚠️ Could not start the auto join. Please try again.", reply_markup=kb_back_to_toolkit())
+        await send_new_banner_text(user_id, context, f"📥 Auto Join started\n📊 0/{len(items)} — progress updates here.", kb_back_to_toolkit())
+        schedule_job(user_id, "auto_join", job_id, context.bot)
         u["step"] = None
         save_user(user_id)
         return
@@ -2599,123 +3630,35 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         caption_html = update.message.caption or ""
         out_text = (caption_html or txt_html).strip()
 
-        async def dl(file_id: str, suffix: str) -> str:
-            fobj = await context.bot.get_file(file_id)
-            # Use temp directory for downloaded files
-            temp_dir = Path("./temp")
-            temp_dir.mkdir(exist_ok=True)
-            local = temp_dir / f"bc_{user_id}_{secrets.token_hex(4)}{suffix}"
-            await fobj.download_to_drive(custom_path=str(local))
-            return str(local)
-
-        media_path, media_type = None, None
+        # Only the file reference is kept here; the job downloads it
+        media = None
         if update.message.photo:
-            file_id = update.message.photo[-1].file_id
-            media_path = await dl(file_id, ".jpg"); media_type = "photo"
+            media = {"file_id": update.message.photo[-1].file_id, "suffix": ".jpg"}
         elif update.message.animation:
-            file_id = update.message.animation.file_id
-            media_path = await dl(file_id, ".mp4"); media_type = "animation"
+            media = {"file_id": update.message.animation.file_id, "suffix": ".mp4"}
         elif update.message.video:
-            file_id = update.message.video.file_id
-            media_path = await dl(file_id, ".mp4"); media_type = "video"
+            media = {"file_id": update.message.video.file_id, "suffix": ".mp4"}
         elif update.message.document:
-            file_id = update.message.document.file_id
             name = update.message.document.file_name or "file.bin"
             ext = "." + name.split(".")[-1] if "." in name else ".bin"
-            media_path = await dl(file_id, ext); media_type = "document"
+            media = {"file_id": update.message.document.file_id, "suffix": ext}
 
-        client = get_final_client(user_id)
-        if client is None or not sfile(load_user(user_id)["session_base"]).exists():
+        if not out_text and not media:
+            return await context.bot.send_message(chat_id=chat_id, text="Please send a text or media message to broadcast.", reply_markup=kb_back_to_toolkit())
+        if not has_session(user_id):
             return await context.bot.send_message(chat_id=chat_id, text="Please login first from the main flow.", reply_markup=kb_back_to_toolkit())
+        if job_running(user_id, "broadcast"):
+            return await context.bot.send_message(chat_id=chat_id, text="📢 A broadcast is already running. Cancel it or wait for it to finish.", reply_markup=kb_back_to_toolkit())
 
-        sent = 0
-        failed = 0
-        total_chats = 0
-        
-        # Send initial log
-        await send_log_to_user(
-            user_id,
-            f"📢 Mass Broadcast Started\n\n"
-            f"📨 Sending to all private chats...\n"
-            f"⏳ Please wait..."
-        )
-        
-        await client.connect()
-        try:
-            from telethon.tl.types import User as TLUser
-            async for dlg in client.iter_dialogs(limit=1000):
-                ent = dlg.entity
-                total_chats += 1
-                user_name = getattr(ent, 'first_name', 'Unknown User')
-                
-                try:
-                    if isinstance(ent, TLUser) and not ent.bot and not ent.is_self:
-                        if media_path:
-                            await client.send_file(ent, file=media_path, caption=out_text or None)
-                        else:
-                            if out_text:
-                                await client.send_message(ent, out_text)
-                            else:
-                                continue
-                        sent += 1
-                        
-                        # Send log every 10 successful sends
-                        if sent % 10 == 0:
-                            await send_log_to_user(
-                                user_id,
-                                f"✅ Progress Update\n\n"
-                                f"📊 Sent: {sent} chats\n"
-                                f"❌ Failed: {failed}\n"
-                                f"🔄 Continuing..."
-                            )
-                        
-                        await asyncio.sleep(0.2)
-                except Exception as e:
-                    failed += 1
-                    # Log failures occasionally
-                    if failed % 20 == 0:
-                        await send_log_to_user(
-                            user_id,
-                            f"⚠️ Some failures detected\n\n"
-                            f"✅ Sent: {sent}\n"
-                            f"❌ Failed: {failed}\n"
-                            f"🔄 Continuing..."
-                        )
-        finally:
-            await client.disconnect()
-            try:
-                if media_path:
-                    Path(media_path).unlink(missing_ok=True)
-            except Exception:
-                pass
-
-        # Send final log
-        await send_log_to_user(
-            user_id,
-            f"✅ Mass Broadcast Complete\n\n"
-            f"📊 Total chats processed: {total_chats}\n"
-            f"✅ Successfully sent: {sent}\n"
-            f"❌ Failed: {failed}\n"
-            f"📈 Success rate: {(sent/total_chats*100) if total_chats > 0 else 0:.1f}%"
-        )
-
-        await send_new_banner_text(user_id, context, f"✅ Broadcast sent to {sent} chats.", kb_back_to_toolkit())
+        job_id = create_job(user_id, "broadcast", {"text": out_text, "media": media, "done": [], "sent": 0, "failed": 0})
+        if job_id is None:
+            return await context.bot.send_message(chat_id=chat_id, text="⚠️ Could not start the broadcast. Please try again.", reply_markup=kb_back_to_toolkit())
         u["step"] = None
-        save_user(user_id)
+        await send_new_banner_text(user_id, context, "📢 Mass Broadcast started…\nProgress updates here.", kb_broadcast_running(job_id))
+        schedule_job(user_id, "broadcast", job_id, context.bot)
         return
 
-    # 4) Passive Auto-Reply (safe for groups: only reply when keyword matches)
-    f = _ensure_features_dict(u)
-    ar = f["auto_reply"]
-    if ar.get("enabled"):
-        text = update.message.text or update.message.caption or ""
-        if text:
-            reply = find_reply(ar.get("pairs", []), text)
-            if reply:
-                try:
-                    await update.message.reply_text(reply, disable_web_page_preview=True)
-                except Exception:
-                    pass
+    # Auto replies run on the user's own account (see Auto-reply listeners), not on bot chats
     
     # ===== END MOREFEATURES HANDLING =====
 
@@ -2805,9 +3748,12 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await client.sign_in(password=pwd_in)
             await client.disconnect()
             LOGIN_CLIENTS.pop(user_id, None)
+            await stop_reply_listener(user_id)
+            await drop_client(user_id)
             finalize_tmp_to_final(user_id)
             u["step"] = STEP_NONE
             save_user(user_id)
+            await ensure_reply_listener(user_id)
             
             # Upload session to MongoDB
             session_path = u.get("session_base")
@@ -3033,18 +3979,13 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await context.bot.send_message(chat_id=chat_id, text="❌ Please login first.")
             return
 
-        ok = await collect_user_groups(user_id)
+        ok = await ensure_destinations(user_id, context.bot)
         if not ok:
             await context.bot.send_message(chat_id=chat_id, text="❌ Failed to load groups.")
             return
 
-        # Filter to show only topics (same as Selected groups UI)
-        all_groups = u["group_picker"]["groups"]
-        topics_only = [g for g in all_groups if g.get("group_type") == "topic"]
-        u["group_picker"]["groups"] = topics_only
-        u["group_picker"]["selected_ids"] = []
-        u["group_picker"]["page"] = 0
-        u["group_picker"]["search_filter"] = ""  # Enable search
+        # Show only topics (same as Selected groups UI), search enabled
+        reset_group_picker(u, scope=["topic"])
         save_user(user_id)
 
         # Show group picker UI with search functionality
@@ -3317,197 +4258,324 @@ async def show_confirm_groups(user_id: int, context: ContextTypes.DEFAULT_TYPE):
 async def show_group_picker(user_id: int, context: ContextTypes.DEFAULT_TYPE):
     u = load_user(user_id)
     gp = u["group_picker"]
-    groups = gp["groups"]
-    total = len(groups)
+    state = picker_state(user_id)
+    # Count only groups and topics (forums are never stored)
+    non_forum_count = len(state.order)
     page = gp["page"]
     per_page = GROUPS_PAGE_SIZE
-    pages = max(1, (total + per_page - 1) // per_page)
-    # Count only groups and topics (exclude forums from display)
-    non_forum_count = sum(1 for g in groups if g.get("group_type") != "forum")
-    header = f"🎯 {len(gp['selected_ids'])}/{non_forum_count} SELECTED 💛 {page+1}/{pages} PAGE\nTap to select groups & topics. Pinned items shown first."
+    pages = max(1, (non_forum_count + per_page - 1) // per_page)
+    header = f"🎯 {len(state.selected)}/{non_forum_count} SELECTED 💛 {page+1}/{pages} PAGE\nTap to select groups & topics. Pinned items shown first."
     kb = group_picker_kb(user_id)
     await edit_caption_keep_banner(user_id, context, header, kb)
 
-async def fetch_forum_topics_parallel(client, ent, disp_id, title):
-    """Fetch forum topics - optimized for parallel execution"""
+def cache_topics(key: Tuple[Optional[int], int], topics: List[Dict[str, Any]]):
+    """Store a forum's topics; entries past TOPIC_CACHE_TTL or beyond TOPIC_CACHE_SIZE are pruned here"""
+    TOPIC_CACHE[key] = (time.time(), topics)
+    TOPIC_CACHE.move_to_end(key)
+    cutoff = time.time() - TOPIC_CACHE_TTL
+    while TOPIC_CACHE:
+        oldest = next(iter(TOPIC_CACHE.values()))
+        if len(TOPIC_CACHE) <= TOPIC_CACHE_SIZE and oldest[0] >= cutoff:
+            break
+        TOPIC_CACHE.popitem(last=False)
+
+async def fetch_forum_topics_parallel(client, ent, disp_id, title, user_id: Optional[int] = None, sem: Optional[asyncio.Semaphore] = None):
+    """Fetch ALL forum topics - paginated, bounded by ``sem``, cached per (user, forum) for TOPIC_CACHE_TTL"""
+    from telethon.tl.functions.channels import GetForumTopicsRequest
+    from telethon.tl.types import ForumTopic
+
+    cache_key = (user_id, disp_id)
+    cached = TOPIC_CACHE.get(cache_key)
+    if cached and time.time() - cached[0] < TOPIC_CACHE_TTL:
+        return (disp_id, cached[1])
+    if sem is None:
+        sem = asyncio.Semaphore(TOPIC_FETCH_CONCURRENCY)
+
+    last_error = None
+    for attempt in range(TOPIC_FETCH_RETRIES):
+        try:
+            topics = []
+            seen = set()
+            offset_date, offset_id, offset_topic = 0, 0, 0
+            while True:
+                async with sem:
+                    result = await client(GetForumTopicsRequest(
+                        channel=ent,
+                        offset_date=offset_date,
+                        offset_id=offset_id,
+                        offset_topic=offset_topic,
+                        limit=TOPIC_PAGE_SIZE
+                    ))
+
+                new = 0
+                for topic in result.topics:
+                    if not isinstance(topic, ForumTopic) or topic.id in seen:
+                        continue
+                    seen.add(topic.id)
+                    new += 1
+                    topics.append({
+                        "topic_id": topic.id,
+                        "title": getattr(topic, 'title', f'Topic {topic.id}'),
+                        "display_id": f"{disp_id}:{topic.id}",
+                        "parent_title": title,
+                        "parent_id": disp_id
+                    })
+
+                # Next page starts after the last topic (by its top message)
+                if not result.topics or new == 0 or len(seen) >= getattr(result, "count", 0):
+                    break
+                last = result.topics[-1]
+                offset_topic = last.id
+                offset_id = getattr(last, "top_message", 0) or 0
+                offset_date = next((m.date for m in result.messages if m.id == offset_id and getattr(m, "date", None)), 0)
+
+            cache_topics(cache_key, topics)
+            return (disp_id, topics)
+        except FloodWaitError as fw:
+            last_error = fw
+            print(f"⏳ Flood wait {fw.seconds}s fetching topics for {title}")
+            await asyncio.sleep(fw.seconds + 1)
+        except Exception as e:
+            last_error = e
+            await asyncio.sleep(TOPIC_FETCH_BACKOFF * (2 ** attempt))
+
+    print(f"Error fetching topics for {title} after {TOPIC_FETCH_RETRIES} attempts: {last_error}")
+    # Prefer stale topics over none at all; None tells the caller the fetch failed
+    if cached:
+        return (disp_id, cached[1])
+    return (disp_id, None)
+
+def classify_dialog(d) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Classify a dialog on the fly: ("group", entry), ("forum", info) or (None, None)"""
+    ent = d.entity
+    is_group_like, disp_id = False, None
+
+    try:
+        # Mega group / supergroup
+        if isinstance(ent, Channel) and getattr(ent, "megagroup", False):
+            is_group_like = True
+            disp_id = int(f"-100{ent.id}")
+
+        # Ordinary basic group
+        elif isinstance(d.input_entity, PeerChat) or isinstance(ent, Chat):
+            is_group_like = True
+            disp_id = -int(ent.id)
+
+        # Exclude broadcast-only channels
+        if isinstance(ent, Channel) and getattr(ent, "broadcast", False):
+            is_group_like = False
+
+    except Exception:
+        pass
+
+    if not is_group_like or disp_id is None:
+        return None, None
+
+    title = getattr(ent, "title", "Unnamed Group")
+
+    # Forums are a special type of supergroup - only their topics become destinations
+    if isinstance(ent, Channel) and getattr(ent, "forum", False):
+        return "forum", {"entity": ent, "display_id": disp_id, "title": title}
+
+    return "group", {
+        "title": f"📁 {title}",  # Groups emoji (both regular and supergroups)
+        "pinned": bool(getattr(d, "pinned", False)),
+        "display_id": disp_id,
+        "group_type": "group",  # Merged type
+        "username": (getattr(ent, "username", None) or "").lower() or None,
+    }
+
+def topic_entry(topic: Dict[str, Any]) -> Dict[str, Any]:
+    """Selectable destination entry for a forum topic"""
+    return {
+        "title": f"📌 {topic['title']} (in {topic['parent_title']})",
+        "pinned": False,
+        "display_id": topic["display_id"],
+        "group_type": "topic",  # Mark as topic
+        "parent_group": topic["parent_id"],
+        "topic_id": topic["topic_id"]
+    }
+
+def _flush_destinations(user_id: int, scan_id: str, chunk: List[Dict[str, Any]]):
+    """Upsert a chunk of destinations into their collection, tagged with the current scan"""
+    if not chunk:
+        return
+    ops = [
+        UpdateOne(
+            {"user_id": user_id, "display_id": entry["display_id"]},
+            {"$set": {**entry, "user_id": user_id, "title_lc": entry["title"].lower(), "scan_id": scan_id}},
+            upsert=True
+        )
+        for entry in chunk
+    ]
     try:
-        from telethon.tl.functions.channels import GetForumTopicsRequest
-        from telethon.tl.types import ForumTopic
-        
-        result = await client(GetForumTopicsRequest(
-            channel=ent,
-            offset_date=0,
-            offset_id=0,
-            offset_topic=0,
-            limit=500
-        ))
-        
-        topics = []
-        for topic in result.topics:
-            if isinstance(topic, ForumTopic):
-                topic_title = getattr(topic, 'title', f'Topic {topic.id}')
-                topics.append({
-                    "topic_id": topic.id,
-                    "title": topic_title,
-                    "display_id": f"{disp_id}:{topic.id}",
-                    "parent_title": title,
-                    "parent_id": disp_id
-                })
-        return (disp_id, topics)
+        destinations_collection.bulk_write(ops, ordered=False)
     except Exception as e:
-        print(f"Error fetching topics for {title}: {e}")
-        return (disp_id, [])
+        print(f"⚠️ MongoDB destinations write error for user {user_id}: {e}")
 
-async def collect_user_groups(user_id: int) -> bool:
-    u = load_user(user_id)
-    client = get_final_client(user_id)
-    if client is None:
-        return False
+async def sync_destinations(user_id: int, client: TelegramClient, bot=None) -> bool:
+    """Stream every dialog, classify it on the fly and upsert destinations in chunks.
+
+    Uses an already connected client. Only compact entries are kept; ``Dialog``
+    objects are dropped as soon as they are classified. When ``bot`` is given,
+    progress is reported on the banner. The picker view/selection is untouched.
+    """
+    scan_id = secrets.token_hex(4)
+    chunk: List[Dict[str, Any]] = []
+    forums: List[Dict[str, Any]] = []
+    failed_forums: List[int] = []
+    scanned = groups_count = topics_count = 0
+    members: set = set()
+
+    async def report(stage: str):
+        if bot is None:
+            return
+        await edit_banner_progress(
+            user_id, bot,
+            f"🔄 {stage}\n\n"
+            f"💬 Chats scanned: {scanned}\n"
+            f"📁 Groups: {groups_count}\n"
+            f"📌 Topics: {topics_count}"
+        )
 
-    await client.connect()
+    async for d in client.iter_dialogs(ignore_migrated=True):
+        scanned += 1
+        members.update(membership_keys(d.id, getattr(d.entity, "username", None)))
+        kind, info = classify_dialog(d)
+        if kind == "group":
+            chunk.append(info)
+            groups_count += 1
+        elif kind == "forum":
+            forums.append(info)
+
+        if len(chunk) >= DIALOG_CHUNK_SIZE:
+            _flush_destinations(user_id, scan_id, chunk)
+            chunk = []
+        if scanned % DIALOG_CHUNK_SIZE == 0:
+            await report("Scanning your chats…")
+
+    save_memberships(user_id, members, time.time())
+
+    # Fetch forum topics and add ONLY topics (not the parent forum groups)
+    if forums:
+        print(f"⚡ Fetching topics from {len(forums)} forum groups ({TOPIC_FETCH_CONCURRENCY} at a time)...")
+        await report("Fetching forum topics…")
+        sem = asyncio.Semaphore(TOPIC_FETCH_CONCURRENCY)
+        topic_results = await asyncio.gather(
+            *[fetch_forum_topics_parallel(client, f["entity"], f["display_id"], f["title"], user_id, sem) for f in forums],
+            return_exceptions=True
+        )
+        for forum, result in zip(forums, topic_results):
+            topics = result[1] if isinstance(result, tuple) and len(result) == 2 else None
+            if topics is None:
+                failed_forums.append(forum["display_id"])
+                continue
+            for topic in topics:
+                chunk.append(topic_entry(topic))
+                topics_count += 1
+                if len(chunk) >= DIALOG_CHUNK_SIZE:
+                    _flush_destinations(user_id, scan_id, chunk)
+                    chunk = []
+        print(f"✅ Fetched {topics_count} topics from {len(forums)} forum groups")
+
+    _flush_destinations(user_id, scan_id, chunk)
+    # Drop destinations the account is no longer part of. Topics of forums whose
+    # fetch failed are kept as they were (with any selection pointing at them).
+    stale = {"user_id": user_id, "scan_id": {"$ne": scan_id}}
     try:
-        if not await client.is_user_authorized():
-            return False
+        if failed_forums:
+            print(f"⚠️ Keeping previous topics of {len(failed_forums)} forum(s) that could not be fetched")
+            stale["parent_group"] = {"$nin": failed_forums}
+            topics_count += destinations_collection.count_documents({"user_id": user_id, "group_type": "topic", "parent_group": {"$in": failed_forums}})
+        destinations_collection.delete_many(stale)
+    except Exception as e:
+        print(f"⚠️ MongoDB destinations cleanup error for user {user_id}: {e}")
 
-        dialogs: List[Dialog] = await client.get_dialogs(limit=500)
-        groups = []
-        forum_fetch_tasks = []  # Parallel forum topic fetching
+    flush_pending_toggles(user_id)  # the rebuild below re-reads selected_ids
+    gp = load_user(user_id)["group_picker"]
+    gp["counts"] = {"group": groups_count, "topic": topics_count}
+    gp["synced_at"] = time.time()
+    try:
+        users_collection.update_one({"user_id": user_id}, {"$set": {"group_picker.counts": gp["counts"], "group_picker.synced_at": gp["synced_at"]}})
+    except Exception as e:
+        print(f"⚠️ MongoDB destinations sync stamp error for user {user_id}: {e}")
+    if user_id in PICKER_STATES:
+        picker_state(user_id)  # rebuild the open picker (and its search index) right away
+    await report("Chats synced")
 
-        for d in dialogs:
-            ent = d.entity
-            is_group_like, disp_id = False, None
+    print(f"✅ Saved {groups_count + topics_count} destinations to user data ({scanned} dialogs scanned)")
+    print(f"   📁 Groups: {groups_count}")
+    print(f"   📌 Topics: {topics_count}")
 
-            try:
-                # Mega group / supergroup
-                if isinstance(ent, Channel) and getattr(ent, "megagroup", False):
-                    is_group_like = True
-                    disp_id = int(f"-100{ent.id}")
+    return True
 
-                # Ordinary basic group
-                elif isinstance(d.input_entity, PeerChat) or isinstance(ent, Chat):
-                    is_group_like = True
-                    disp_id = -int(ent.id)
+async def collect_user_groups(user_id: int, bot=None) -> bool:
+    """Full destination scan on the account's shared client"""
+    client = await acquire_client(user_id)
+    if client is None:
+        return False
 
-                # Exclude broadcast-only channels
-                if isinstance(ent, Channel) and getattr(ent, "broadcast", False):
-                    is_group_like = False
+    try:
+        if not await client.is_user_authorized():
+            return False
+        return await sync_destinations(user_id, client, bot)
+    finally:
+        await release_client(user_id, client)
 
-            except Exception:
-                pass
+def destinations_stale(u: Dict[str, Any]) -> bool:
+    synced_at = u["group_picker"].get("synced_at") or 0
+    return time.time() - synced_at > DEST_REFRESH_INTERVAL
 
-            if not is_group_like or disp_id is None:
-                continue
+def ads_running(user_id: int) -> bool:
+    for tasks in (ADS_WORKERS, AD_TASKS):
+        t = tasks.get(user_id)
+        if t and not t.done():
+            return True
+    return False
 
-            title = getattr(ent, "title", "Unnamed Group")
-            
-            # Determine group type - MUST match the detection logic above
-            is_regular_group = False
-            is_supergroup = False
-            is_forum_group = False
-            
-            # Check in the SAME order as initial detection
-            if isinstance(ent, Channel) and getattr(ent, "megagroup", False):
-                # This is a supergroup (or will be forum if topics enabled)
-                is_supergroup = True
-            elif isinstance(d.input_entity, PeerChat) or isinstance(ent, Chat):
-                # This is a regular basic group
-                is_regular_group = True
-            
-            # Add emoji prefix based on type
-            # Merge regular and supergroups into just "groups"
-            if is_regular_group or is_supergroup:
-                display_title = f"📁 {title}"  # Groups emoji (both regular and supergroups)
-            else:
-                display_title = title
-            
-            group_entry = {
-                "title": display_title,
-                "original_title": title,
-                "pinned": bool(getattr(d, "pinned", False)),
-                "display_id": disp_id,
-                "is_forum": False,
-                "topics": [],
-                "is_regular_group": is_regular_group,
-                "is_supergroup": is_supergroup,
-                "group_type": "group" if (is_regular_group or is_supergroup) else "unknown",  # Merged type
-                "_entity": ent  # Store temporarily for parallel fetch
-            }
-            
-            # Check if this group has forum topics enabled (forums are a special type of supergroup)
-            if isinstance(ent, Channel) and getattr(ent, "forum", False):
-                group_entry["is_forum"] = True
-                group_entry["is_supergroup"] = False  # Override - forums are their own category
-                group_entry["group_type"] = "forum"
-                group_entry["title"] = f"💬 {title}"  # Forum group emoji
-                is_forum_group = True
-                # Queue task for parallel fetching
-                forum_fetch_tasks.append(fetch_forum_topics_parallel(client, ent, disp_id, title))
-                # Don't add the forum group itself - only topics will be added later
-                continue
-            
-            groups.append(group_entry)
-        
-        # Fetch ALL forum topics in PARALLEL and add ONLY topics (not parent forum groups)
-        if forum_fetch_tasks:
-            print(f"⚡ Fetching topics from {len(forum_fetch_tasks)} forum groups in parallel...")
-            topic_results = await asyncio.gather(*forum_fetch_tasks, return_exceptions=True)
-            
-            # Add ONLY topics as separate selectable items (not forum parent groups)
-            total_topics = 0
-            for result in topic_results:
-                if isinstance(result, tuple) and len(result) == 2:
-                    group_id, topics = result
-                    # Add each topic as a separate selectable item
-                    for topic in topics:
-                        groups.append({
-                            "title": f"📌 {topic['title']} (in {topic['parent_title']})",
-                            "original_title": topic['title'],
-                            "pinned": False,
-                            "display_id": topic["display_id"],
-                            "is_forum": False,
-                            "topics": [],
-                            "is_regular_group": False,
-                            "is_supergroup": False,
-                            "group_type": "topic",  # Mark as topic
-                            "parent_group": topic["parent_id"],
-                            "topic_id": topic["topic_id"]
-                        })
-                        total_topics += 1
-            print(f"✅ Fetched {total_topics} topics from {len(forum_fetch_tasks)} forum groups")
-        
-        # Clean up temporary entity storage and ensure all required fields are present
-        for g in groups:
-            g.pop("_entity", None)
-            # Ensure group_type exists (fallback for older entries or edge cases)
-            if "group_type" not in g:
-                if "parent_group" in g or ":" in str(g.get("display_id", "")):
-                    g["group_type"] = "topic"
-                elif g.get("is_forum", False):
-                    g["group_type"] = "forum"
-                elif g.get("is_regular_group", False) or g.get("is_supergroup", False):
-                    g["group_type"] = "group"  # Merged type
-                else:
-                    g["group_type"] = "unknown"
+def schedule_destination_refresh(user_id: int) -> Optional[asyncio.Task]:
+    """Re-sync destinations in the background (at most one refresh per user).
 
-        # Sort pinned first, then alphabetically
-        groups.sort(key=lambda x: (not x["pinned"], x["title"].lower()))
+    Skipped while ads are running: the ads worker refreshes between rounds on
+    its own connected client, so the session is never opened twice.
+    """
+    t = DEST_SYNC_TASKS.get(user_id)
+    if t and not t.done():
+        return t
+    if ads_running(user_id):
+        return None
+    t = asyncio.create_task(collect_user_groups(user_id))
+    DEST_SYNC_TASKS[user_id] = t
+    return t
 
-        u["group_picker"] = {"page": 0, "groups": groups, "selected_ids": []}
-        save_user(user_id)
-        
-        # Count only groups and topics (exclude forum containers)
-        groups_count = sum(1 for g in groups if g.get('group_type') == 'group')
-        topics_count = sum(1 for g in groups if g.get('group_type') == 'topic')
-        total_destinations = groups_count + topics_count
-        
-        print(f"✅ Saved {total_destinations} destinations to user data")
-        print(f"   📁 Groups: {groups_count}")
-        print(f"   📌 Topics: {topics_count}")
-        
+async def ensure_destinations(user_id: int, bot=None) -> bool:
+    """Use cached destinations right away (refreshing stale ones in the background); only the first sync blocks"""
+    u = load_user(user_id)
+    if u["group_picker"].get("synced_at"):
+        if destinations_stale(u):
+            schedule_destination_refresh(user_id)
         return True
+    pending = DEST_SYNC_TASKS.get(user_id)
+    if pending and not pending.done():
+        return await pending
+    return await collect_user_groups(user_id, bot)
 
-    finally:
-        await client.disconnect()
+def reset_group_picker(u: Dict[str, Any], scope: Optional[List[str]] = None):
+    gp = u["group_picker"]
+    gp.update({"page": 0, "selected_ids": [], "search_filter": "", "scope": scope})
+    invalidate_picker_state(u["user_id"])
+
+async def refresh_destinations_idle(user_id: int, client: TelegramClient) -> bool:
+    """Between ad rounds: re-sync on the worker's own client when the cached list is stale"""
+    if not destinations_stale(load_user(user_id)):
+        return False
+    try:
+        return await sync_destinations(user_id, client)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"⚠️ Background destination refresh failed for user {user_id}: {e}")
+        return False
 
 # ---------- Ads Loop ----------
 async def start_ads_loop(user_id: int, context: ContextTypes.DEFAULT_TYPE):
@@ -3590,16 +4658,16 @@ async def ads_worker(user_id: int, context: ContextTypes.DEFAULT_TYPE):
     saved_msg_id, saved_from_peer = a.get("saved_msg_id"), a.get("saved_from_peer", "me")
     saved_as_copy = a.get("saved_as_copy")
 
-    client = get_final_client(user_id)
+    client = await acquire_client(user_id)
     if client is None:
         await edit_banner_strict(user_id, context, "Login required to send ads.", new_main_menu_kb(user_id))
         return
 
-    await client.connect()
     try:
         if not await client.is_user_authorized():
             await edit_banner_strict(user_id, context, "Session expired. Please login again.", new_main_menu_kb(user_id))
             return
+        set_ads_running(user_id, True)
 
         async def resolve_entity_from_display(disp_id):
             """Resolve entity and extract topic_id if present"""
@@ -3765,6 +4833,7 @@ async def ads_worker(user_id: int, context: ContextTypes.DEFAULT_TYPE):
                 if ok:
                     u["metrics"]["sent_total"] = int(u["metrics"].get("sent_total", 0) or 0) + 1
                     save_user(user_id)
+                    bump_stats({"sent": 1})
                     
                     # Build view message URL
                     message_link = None
@@ -3826,7 +4895,15 @@ async def ads_worker(user_id: int, context: ContextTypes.DEFAULT_TYPE):
                 f"⏳ Waiting {round_delay}s before next round..."
             )
             
-            await asyncio.sleep(round_delay)
+            # Idle period: refresh the destination cache on this connected client
+            idle_started = time.time()
+            if await refresh_destinations_idle(user_id, client) and a.get("target_mode") == "all_groups":
+                fresh = [{"display_id": gid} for gid in destination_ids(user_id, ["group"])]
+                if fresh:
+                    targets = a["targets"] = fresh
+                    save_user(user_id)
+
+            await asyncio.sleep(max(0, round_delay - (time.time() - idle_started)))
     except asyncio.CancelledError:
         await send_log_to_user(
             user_id,
@@ -3834,7 +4911,8 @@ async def ads_worker(user_id: int, context: ContextTypes.DEFAULT_TYPE):
             f"📊 Total ads sent: {u['metrics'].get('sent_total', 0)}"
         )
     finally:
-        await client.disconnect()
+        set_ads_running(user_id, False)
+        await release_client(user_id, client)
 
 # ---------- Errors ----------
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -3842,7 +4920,14 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 # ---------- Handlers & App ----------
 def build_app() -> Application:
-    return ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
+    return (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(_on_startup)
+        .post_shutdown(close_client_pool)
+        .build()
+    )
 
 # No need for external module registration - everything is integrated directly
 